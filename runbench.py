@@ -0,0 +1,255 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+
+def python(code, **kwargs):
+    return subprocess.Popen(
+            [sys.executable, '-c', code],
+            cwd=here,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            **kwargs)
+
+
+def child_report(code):
+    p = python(code)
+    out, _ = p.communicate()
+    if p.returncode:
+        raise RuntimeError('Benchmark child failed: {}'.format(code))
+    return json.loads(out.decode('utf-8').strip().splitlines()[-1])
+
+
+# Run in a fresh interpreter, report import time in ms and peak RSS in KiB
+import_probe = '''
+import json, resource, sys, time
+t = time.perf_counter()
+import {module}
+t = time.perf_counter() - t
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if sys.platform == 'darwin':
+    rss //= 1024
+print(json.dumps({{'time': t * 1000, 'rss': rss}}))
+'''
+
+
+def bench_import(repeat):
+    modules = ['warawara']
+    modules += ['warawara.' + m[:-3] for m in sorted(os.listdir(os.path.join(here, 'warawara')))
+                if m.startswith('lib_') and m.endswith('.py')]
+
+    ret = {}
+    for module in modules:
+        reports = [child_report(import_probe.format(module=module)) for i in range(repeat)]
+        ret['import:{}:ms'.format(module)] = min(r['time'] for r in reports)
+        ret['import:{}:rss'.format(module)] = statistics.median(r['rss'] for r in reports)
+    return ret
+
+
+# Console scripts, invoked the same way as the [project.scripts] entries
+entry_points = {
+        'wara': ('import sys; sys.argv = ["wara"]; import warawara; warawara.bin.wara.main()', None),
+        'palette': ('import sys; sys.argv = ["palette"]; import warawara; warawara.bin.palette.main()', None),
+        'sponge': ('import sys; sys.argv = ["sponge"]; import warawara; warawara.bin.sponge.main()', b'wah\n'),
+        }
+
+
+def bench_entry_points(repeat):
+    ret = {}
+    for name, (code, stdin) in entry_points.items():
+        samples = []
+        for i in range(repeat):
+            t = time.perf_counter()
+            p = python(code, stdin=subprocess.PIPE)
+            if stdin:
+                p.stdin.write(stdin)
+            p.stdin.close()
+            p.stdout.read(1)
+            samples.append((time.perf_counter() - t) * 1000)
+            p.stdout.read()
+            p.stdout.close()
+            p.wait()
+        ret['entry:{}:ms'.format(name)] = min(samples)
+    return ret
+
+
+def timing(func, repeat):
+    import timeit
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+
+def bench_ansi(repeat):
+    import re
+    sys.path.insert(0, here)
+    from warawara import paints
+
+    line = (paints.orange('orange') + ' text \033[2K\033[1A' + paints.paint(fg=1, bg=3)('wah') +
+            '\033]8;;http://example.com\033\\link\033]8;;\033\\ ' + '哇嗚 plain text ' * 3)
+    data = line * 10000
+
+    # The old decolor() only handled SGR, chain more regexes for other sequences
+    chained = [
+            ('sgr', re.compile('\033' + r'\[[\d;:]*m')),
+            ('csi', re.compile('\033' + r'\[[\x30-\x3f]*[\x20-\x2f]*[\x40-\x7e]')),
+            ('osc', re.compile('\033' + r'[\]PX^_][^\007\033]*(?:\007|\033\\)')),
+            ('esc', re.compile('\033' + r'[\x20-\x2f]*[\x30-\x7e]')),
+            ]
+
+    def decolor_chained():
+        s = data
+        for kind, regex in chained:
+            s = regex.sub('', s)
+        return s
+
+    # Run each regex over the whole data, and merge matches by position
+    def tokenize_chained():
+        matches = sorted((m.start(), prio, m.end(), kind)
+                         for prio, (kind, regex) in enumerate(chained)
+                         for m in regex.finditer(data))
+        tokens = []
+        pos = 0
+        for start, prio, end, kind in matches:
+            if start < pos:
+                continue
+            if pos < start:
+                tokens.append(('text', data[pos:start]))
+            tokens.append((kind, data[start:end]))
+            pos = end
+        if pos < len(data):
+            tokens.append(('text', data[pos:]))
+        return tokens
+
+    assert decolor_chained() == paints.decolor(data)
+    assert tokenize_chained() == list(paints.ansi_tokenize(data))
+
+    return {
+            'ansi:decolor:ms': timing(lambda: paints.decolor(data), repeat),
+            'ansi:decolor-chained-regex:ms': timing(decolor_chained, repeat),
+            'ansi:tokenize:ms': timing(lambda: list(paints.ansi_tokenize(data)), repeat),
+            'ansi:tokenize-chained-regex:ms': timing(tokenize_chained, repeat),
+            }
+
+
+def bench_sgr(repeat):
+    sys.path.insert(0, here)
+    from warawara import paints
+
+    # Cells like the ones bin/palette prints, each painted independently
+    data = ''
+    for row in range(16):
+        data += ''.join(paints.paint(fg=0, bg=row * 16 + col)(' {:03} '.format(row * 16 + col))
+                        for col in range(16)) + '\n'
+        data += ''.join(paints.dye(row * 16 + col)('wah') + ' ' for col in range(16)) + '\n'
+    data *= 100
+
+    minimized = paints.sgr_minimize(data)
+    assert paints.decolor(minimized) == paints.decolor(data)
+
+    return {
+            'sgr:bytes-before': len(data.encode('utf-8')),
+            'sgr:bytes-after': len(minimized.encode('utf-8')),
+            'sgr:minimize:ms': timing(lambda: paints.sgr_minimize(data), repeat),
+            }
+
+
+def bench_tui(repeat):
+    import unicodedata
+    sys.path.insert(0, here)
+    from warawara import paints, tui
+    from warawara.lib_tui import strwidth_cached
+
+    cells = ['{} 哇嗚 {} 測試'.format(paints.orange(str(i)), i * 7) for i in range(10000)]
+    cells += ['word {}'.format(i) for i in range(10000)]
+
+    # strwidth() before the width table
+    def strwidth_unicodedata(s):
+        return sum((1 + (unicodedata.east_asian_width(c) in 'WF')) for c in paints.decolor(s))
+
+    def strwidth_uncached(s):
+        return strwidth_cached.__wrapped__(s) if not s.isascii() else tui.strwidth(s)
+
+    table = [(paints.orange('哇嗚 {}'.format(i)), 'row {}'.format(i), '測試' * (i % 5), str(i * 7)) for i in range(20000)]
+
+    return {
+            'tui:ljust:ms': timing(lambda: tui.ljust(table), repeat),
+            'tui:ljust-width:ms': timing(lambda: tui.ljust(table, width=(12, 10, 10, 6)), repeat),
+            'tui:rjust-fillchar-func:ms': timing(lambda: tui.rjust(table, fillchar=lambda row, col, text: '.'), repeat),
+            'tui:table:ms': timing(lambda: tui.table(table, border='single', maxwidth=(None, None, 6, None)), repeat),
+            'tui:table-wrap:ms': timing(lambda: tui.table(table, maxwidth=8, wrap=True), repeat),
+            'tui:strwidth-unicodedata:ms': timing(lambda: [strwidth_unicodedata(c) for c in cells], repeat),
+            'tui:strwidth-uncached:ms': timing(lambda: [strwidth_uncached(c) for c in cells], repeat),
+            'tui:strwidth:ms': timing(lambda: [tui.strwidth(c) for c in cells], repeat),
+            }
+
+
+benchmarks = {
+        'import': bench_import,
+        'entry': bench_entry_points,
+        'ansi': bench_ansi,
+        'sgr': bench_sgr,
+        'tui': bench_tui,
+        }
+
+
+def compare(baseline, result, tolerance):
+    regressions = []
+    for key, value in sorted(result.items()):
+        base = baseline.get(key)
+        if base is None:
+            print('{:<40} {:>12.3f}   (new)'.format(key, value))
+            continue
+
+        ratio = value / base if base else 1
+        mark = ''
+        if ratio > 1 + tolerance:
+            mark = 'REGRESSION'
+            regressions.append(key)
+        print('{:<40} {:>12.3f} {:>12.3f} {:>+8.1%} {}'.format(key, value, base, ratio - 1, mark))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='runbench.py', description='Benchmarks for startup time, import cost and hot paths')
+    parser.add_argument('-n', '--repeat', type=int, default=10, help='Repeat count of each measurement')
+    parser.add_argument('-s', '--save', metavar='FILE', help='Save result as baseline')
+    parser.add_argument('-c', '--compare', metavar='FILE', help='Compare result against baseline, exit 1 on regression')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.25, help='Allowed ratio of slowdown')
+    parser.add_argument('suites', nargs='*', help='Suites to run: {}, default: all'.format(', '.join(benchmarks)))
+    args = parser.parse_args()
+
+    for name in args.suites:
+        if name not in benchmarks:
+            parser.error('Unknown suite: {}'.format(name))
+
+    result = {}
+    for name in (args.suites or benchmarks):
+        result.update(benchmarks[name](args.repeat))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(result, f, indent=4, sort_keys=True)
+
+    if not args.compare:
+        for key, value in sorted(result.items()):
+            print('{:<40} {:>12.3f}'.format(key, value))
+        return
+
+    with open(args.compare) as f:
+        baseline = json.load(f)
+
+    regressions = compare(baseline, result, args.tolerance)
+    if regressions:
+        print('{} regression(s) found'.format(len(regressions)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
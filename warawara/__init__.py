@@ -9,50 +9,62 @@ check_python_version()
 del check_python_version
 
 
-def load_internal_modules(prefix, post_load_hook):
+# Internal modules are imported on first access, so "import warawara" stays cheap
+# External name -> internal module
+_modules = {
+        'itertools': 'lib_itertools',
+        'math': 'lib_math',
+        'paints': 'lib_paints',
+        'regex': 'lib_regex',
+        'subproc': 'lib_subproc',
+        'tui': 'lib_tui',
+        'bin': 'bin',
+        }
+
+# Internal module -> exported attributes, must match the __all__ of each module
+_exports = {
+        'lib_itertools': ['iterable', 'unwrap_one', 'flatten', 'lookahead', 'zip_longest'],
+        'lib_math': ['is_int', 'sgn', 'lerp', 'interval', 'vector', 'distribute'],
+        'lib_paints': [
+            'paint', 'styled',
+            'nocolor', 'black', 'red', 'green', 'yellow', 'blue', 'magenta', 'cyan', 'white', 'orange',
+            'decolor', 'decolorizer', 'decolor_file', 'ansi_tokenize',
+            'sgr_minimize', 'sgr_minimizer',
+            'dye', 'dye256', 'dyergb', 'gradient', 'gradient_packed',
+            'quantize',
+            'detect_color_depth', 'set_color_depth',
+            ],
+        'lib_regex': ['rere'],
+        'lib_subproc': [
+            'stream', 'bounded', 'tail', 'command', 'run', 'arun', 'pipe',
+            'TimeoutExpired', 'AlreadyRunningError',
+            'RunMocker',
+            ],
+        'lib_tui': [
+            'strwidth', 'ljust', 'rjust', 'table',
+            'ThreadedSpinner', 'ProgressBar', 'Progress', 'prompt',
+            ],
+        }
+
+_attrs = {attr: mod_name for mod_name, attrs in _exports.items() for attr in attrs}
+
+__all__ = list(_modules) + list(_attrs)
+
+
+def __getattr__(name):
     import importlib
-    import pkgutil
-    scope_prefix = __name__ + '.'
-    for mod_info in pkgutil.iter_modules(__path__, scope_prefix):
-        mod_name = mod_info.name[len(scope_prefix):]
-        if not mod_name.startswith(prefix):
-            continue
 
-        module = importlib.import_module(mod_info.name)
-        post_load_hook(module, mod_name)
-
-
-def post_load_lib(module, mod_name):
-    ext_name = mod_name[4:]
-
-    if '__all__' in module.__dict__:
-        attrs = module.__dict__['__all__']
+    if name in _modules:
+        value = importlib.import_module('.' + _modules[name], __name__)
+    elif name in _attrs:
+        value = getattr(importlib.import_module('.' + _attrs[name], __name__), name)
     else:
-        attrs = [x for x in module.__dict__ if not x.startswith('_')]
-
-    # Register module into package namespace with external name
-    globals()[ext_name] = module
-    globals().update({attr: getattr(module, attr) for attr in attrs})
-
-    # Delete old name from package namespace
-    del globals()[mod_name]
-
-
-def post_load_bin(module, mod_name):
-    ext_name = mod_name[4:]
-
-    # Register module into warawara.bin with external name
-    setattr(bin, ext_name, module)
-
-    # Delete old name from package namespace
-    del globals()[mod_name]
-
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
 
-from . import bin
+    # Cache into package namespace, so __getattr__() is not called again
+    globals()[name] = value
+    return value
 
-load_internal_modules('lib_', post_load_lib)
-load_internal_modules('bin_', post_load_bin)
 
-del post_load_lib
-del post_load_bin
-del load_internal_modules
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -1,2 +1,21 @@
 # This file is a placeholder for warawara.bin module
-# The actual sub-modules will be loaded in warawara.__init__.py
+# The actual sub-modules are loaded on first access, e.g. warawara.bin.sponge -> warawara.bin_sponge
+
+_commands = ['ntfy', 'palette', 'rainbow', 'sponge', 'wara']
+
+__all__ = list(_commands)
+
+
+def __getattr__(name):
+    import importlib
+
+    if name not in _commands:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+    module = importlib.import_module('..bin_' + name, __name__)
+    globals()[name] = module
+    return module
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -1,6 +1,9 @@
 import itertools
 
 
+__all__ = ['iterable', 'unwrap_one', 'flatten', 'lookahead', 'zip_longest']
+
+
 def iterable(obj):
     try:
         iter(obj)
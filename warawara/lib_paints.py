@@ -1,10 +1,10 @@
 import re
 import abc
-import itertools
+import bisect
+import functools
+import weakref
 
 from .lib_math import sgn
-from .lib_math import vector
-from .lib_math import lerp
 from .lib_math import interval
 from .lib_math import distribute
 
@@ -16,20 +16,117 @@ except ImportError:  # pragma: no cover
     ic = lambda *a: None if not a else (a[0] if len(a) == 1 else a)  # noqa
 
 
-__all__ = ['paint']
+__all__ = ['paint', 'styled']
 __all__ += ['nocolor', 'black', 'red', 'green', 'yellow', 'blue', 'magenta', 'cyan', 'white', 'orange']
-__all__ += ['decolor']
-__all__ += ['dye', 'dye256', 'dyergb', 'gradient']
+__all__ += ['decolor', 'decolorizer', 'decolor_file', 'ansi_tokenize']
+__all__ += ['sgr_minimize', 'sgr_minimizer']
+__all__ += ['dye', 'dye256', 'dyergb', 'gradient', 'gradient_packed']
+__all__ += ['quantize']
+__all__ += ['detect_color_depth', 'set_color_depth']
 
 
 def is_uint8(i):
     return isinstance(i, int) and not isinstance(i, bool) and 0 <= i < 256
 
 
+bytes_like = (bytes, bytearray, memoryview)
+
+
+def write_bytes(buf, seq, data, reset):
+    '''
+    Write seq + data + reset into buf without joining them first.
+    buf could be a bytearray, or a binary stream that has write().
+    Returns the number of bytes written.
+    '''
+    if isinstance(buf, bytearray):
+        buf += seq
+        buf += data
+        buf += reset
+    else:
+        buf.write(seq)
+        buf.write(data)
+        buf.write(reset)
+
+    return len(seq) + (data.nbytes if isinstance(data, memoryview) else len(data)) + len(reset)
+
+
+# 0 for no color, 16, 256, or 1 << 24 for truecolor, see set_color_depth()
+color_depth = 1 << 24
+
+# Objects with pre-rendered escape sequences, re-rendered when color depth changes
+# Keyed by id(), as equal objects are different instances to be re-rendered
+dye_instances = weakref.WeakValueDictionary()
+paint_instances = weakref.WeakValueDictionary()
+
+
+def detect_color_depth(stream=None, environ=None):
+    '''
+    Guess the color depth that stream supports, from the environment variables.
+    Returns 0 (no color), 16, 256, or 1 << 24 (truecolor).
+    '''
+    import os
+    import sys
+
+    stream = sys.stdout if stream is None else stream
+    environ = os.environ if environ is None else environ
+
+    # https://no-color.org/
+    if environ.get('NO_COLOR'):
+        return 0
+
+    try:
+        if not stream.isatty():
+            return 0
+    except (AttributeError, ValueError):
+        return 0
+
+    term = environ.get('TERM', '')
+    if term == 'dumb':
+        return 0
+
+    if environ.get('COLORTERM', '').lower() in ('truecolor', '24bit'):
+        return 1 << 24
+
+    if '256color' in term:
+        return 256
+
+    return 16
+
+
+def set_color_depth(depth='auto'):
+    '''
+    Set the color depth of all painting output.
+    Colors are downgraded to the nearest one, or removed if depth is 0.
+
+    depth: 'auto' | 0 | 16 | 256 | 1 << 24
+        'auto' calls detect_color_depth() on sys.stdout.
+        Default is 1 << 24, i.e. colors are emitted as-is.
+
+    Escape sequences are rendered here once, so painting has no extra cost afterward.
+    Returns the depth being set.
+    '''
+    global color_depth
+
+    if depth == 'auto':
+        depth = detect_color_depth()
+
+    if depth not in (0, 16, 256, 1 << 24):
+        raise ValueError('Invalid color depth: {}'.format(depth))
+
+    color_depth = depth
+
+    for d in list(dye_instances.values()):
+        d.render()
+
+    for p in list(paint_instances.values()):
+        p.render()
+
+    return depth
+
+
 class DyeTrait(abc.ABC):
-    @abc.abstractmethod
-    def __init__(self, *args, **kwargs): # pragma: no cover
-        raise NotImplementedError
+    # dye objects are interned and immutable, see dye256.__new__() and dyergb.__new__()
+    __slots__ = ()
 
     @abc.abstractmethod
     def __repr__(self): # pragma: no cover
@@ -39,25 +136,84 @@ class DyeTrait(abc.ABC):
     def __int__(self): # pragma: no cover
         raise NotImplementedError
 
+    @classmethod
+    def create(cls, seq, **attrs):
+        self = object.__new__(cls)
+        for attr, value in attrs.items():
+            object.__setattr__(self, attr, value)
+        object.__setattr__(self, 'seq', seq)
+        self.render()
+        dye_instances[id(self)] = self
+        return self
+
+    def params(self, depth):
+        '''
+        Returns the SGR parameters (fg, bg) of this color under the color depth.
+        '''
+        if not self.seq or not depth:
+            return ('', '')
+
+        if depth <= 16:
+            code = nearest_dye16(self)
+            if code < 8:
+                return (str(30 + code), str(40 + code))
+            return (str(82 + code), str(92 + code))
+
+        seq = self.seq
+        if depth <= 256 and isinstance(self, dyergb):
+            seq = quantize(self).seq
+
+        return ('38;' + seq, '48;' + seq)
+
+    def render(self):
+        # Escape sequences are rendered in advance, so painting has no extra cost
+        fg, bg = self.params(color_depth)
+        object.__setattr__(self, 'fg_prefix', '\033[' + fg + 'm' if fg else '')
+        object.__setattr__(self, 'bg_prefix', '\033[' + bg + 'm' if bg else '')
+
+    def __setattr__(self, name, value):
+        raise AttributeError('{} object is immutable'.format(self.__class__.__name__))
+
+    def __delattr__(self, name):
+        raise AttributeError('{} object is immutable'.format(self.__class__.__name__))
+
     def __eq__(self, other):
-        return isinstance(other, self.__class__) and int(self) == int(other)
+        return self is other or (isinstance(other, self.__class__) and int(self) == int(other))
 
     def __call__(self, *args):
         return self.fg(*args)
 
     def fg(self, *args):
-        return self.apply('38', ' '.join(str(arg) for arg in args))
+        if len(args) == 1 and isinstance(args[0], bytes_like):
+            return self.apply('38', args[0])
+        s = str(args[0]) if len(args) == 1 else ' '.join(map(str, args))
+        return f'{self.fg_prefix}{s}\033[m' if self.fg_prefix else s
 
-    def bg(self, *args, **kwargs): # pragma: no cover
-        return self.apply('48', ' '.join(str(arg) for arg in args))
+    def bg(self, *args, **kwargs):
+        if len(args) == 1 and isinstance(args[0], bytes_like):
+            return self.apply('48', args[0])
+        s = str(args[0]) if len(args) == 1 else ' '.join(map(str, args))
+        return f'{self.bg_prefix}{s}\033[m' if self.bg_prefix else s
 
     def apply(self, ground, s):
-        if not self.seq:
+        if isinstance(s, bytes_like):
+            if not self.fg_prefix:
+                return bytes(s)
+            return (self.bg_prefix if ground == '48' else self.fg_prefix).encode('ascii') + s + b'\033[m'
+
+        if not self.fg_prefix:
             return s
-        return '\033[{};{}m{}\033[m'.format(ground, self.seq, str(s))
+        return f'{self.bg_prefix if ground == "48" else self.fg_prefix}{s}\033[m'
+
+    def write(self, buf, data):
+        '''
+        Paint bytes-like data with fg color into buf, which is a bytearray or a binary stream.
+        Returns the number of bytes written.
+        '''
+        return write_bytes(buf, self.fg_prefix.encode('ascii'), data, b'\033[m' if self.fg_prefix else b'')
 
     def __str__(self):
-        return '\033[38;{}m'.format(self.seq) if self.seq else '\033[m'
+        return self.fg_prefix or ('\033[m' if color_depth else '')
 
     def __invert__(self):
         return paint(bg=self)
@@ -75,6 +231,16 @@ class DyeTrait(abc.ABC):
 
 class dye(abc.ABC):
     def __new__(cls, *args, **kwargs):
+        # Fast path: dye(code), dye(r, g, b)
+        if len(args) == 1 and (args[0] is None or type(args[0]) is int):
+            try:
+                return dye256_pool[args[0]]
+            except KeyError:
+                raise TypeError('Invalid color code: {}'.format(args[0])) from None
+
+        if len(args) == 3:
+            return dyergb(*args)
+
         args = unwrap_one(args)
 
         # empty
@@ -101,18 +267,20 @@ class dye(abc.ABC):
 
 
 class dye256(DyeTrait):
-    def __init__(self, code=None):
-        if isinstance(code, self.__class__):
-            code = code.code
+    __slots__ = ('code', 'seq', 'fg_prefix', 'bg_prefix', '__weakref__')
 
-        self.code = code
+    def __new__(cls, code=None):
+        # bool is rejected by the type check, as True == 1 would hit the pool
+        if code is None or type(code) is int:
+            try:
+                return dye256_pool[code]
+            except KeyError:
+                pass
 
-        if code is None:
-            self.seq = ''
-        elif is_uint8(code):
-            self.seq = '5;{}'.format(self.code)
-        else:
-            raise TypeError('Invalid color code: {}'.format(code))
+        elif type(code) is cls:
+            return code
+
+        raise TypeError('Invalid color code: {}'.format(code))
 
     def __repr__(self):
         return '{}({})'.format(self.__class__.__name__, self.code)
@@ -120,37 +288,42 @@ class dye256(DyeTrait):
     def __int__(self):
         return self.code
 
+    def __hash__(self):
+        return hash(self.code)
+
+    def __reduce__(self):
+        return (self.__class__, (self.code,))
+
 dye.register(dye256)
 
+dye256_pool = {None: dye256.create('', code=None)}
+dye256_pool.update((code, dye256.create('5;{}'.format(code), code=code)) for code in range(256))
+
 
 class dyergb(DyeTrait):
-    def __init__(self, *args):
+    __slots__ = ('r', 'g', 'b', 'seq', 'fg_prefix', 'bg_prefix', '__weakref__')
+
+    def __new__(cls, *args):
+        # Fast path: dyergb(r, g, b)
+        if len(args) == 3:
+            return dyergb_pool(*args)
+
         args = unwrap_one(args)
 
         if not args:
-            self.r = 0
-            self.g = 0
-            self.b = 0
-            self.seq = ''
-            return
+            return dyergb_empty
 
-        elif len(args) == 1 and isinstance(args[0], self.__class__):
-            other = args[0]
-            (self.r, self.g, self.b) = (other.r, other.g, other.b)
+        elif len(args) == 1 and isinstance(args[0], cls):
+            return args[0]
 
         elif len(args) == 1 and isinstance(args[0], str) and re.match(r'^#[0-9a-f]{6}$', args[0].lower()):
             rgb_str = args[0][1:]
-            self.r = int(rgb_str[0:2], 16)
-            self.g = int(rgb_str[2:4], 16)
-            self.b = int(rgb_str[4:6], 16)
+            return dyergb_pool(int(rgb_str[0:2], 16), int(rgb_str[2:4], 16), int(rgb_str[4:6], 16))
 
-        elif len(args) == 3 and all(is_uint8(i) for i in args):
-            (self.r, self.g, self.b) = args
-
-        else:
-            raise TypeError('Invalid RGB value: {}'.format(args))
+        elif len(args) == 3:
+            return dyergb_pool(*args)
 
-        self.seq = '2;{};{};{}'.format(self.r, self.g, self.b)
+        raise TypeError('Invalid RGB value: {}'.format(args))
 
     def __repr__(self):
         return 'dyergb({}, {}, {})'.format(self.r, self.g, self.b)
@@ -158,28 +331,162 @@ class dyergb(DyeTrait):
     def __int__(self):
         return (self.r << 16) | (self.g << 8) | (self.b)
 
+    def __hash__(self):
+        return hash(int(self))
+
+    def __reduce__(self):
+        return (self.__class__, (self.r, self.g, self.b) if self.seq else ())
+
+    def to_dye256(self):
+        return quantize(self)
+
 dye.register(dyergb)
 
+dyergb_empty = dyergb.create('', r=0, g=0, b=0)
+
+
+# typed=True keeps bool from being treated as int
+@functools.lru_cache(maxsize=4096, typed=True)
+def dyergb_pool(r, g, b):
+    if not all(is_uint8(i) for i in (r, g, b)):
+        raise TypeError('Invalid RGB value: {}'.format((r, g, b)))
+    return dyergb.create('2;{};{};{}'.format(r, g, b), r=r, g=g, b=b)
+
+
+@functools.lru_cache(maxsize=None)
+def quantize_tables():
+    '''
+    Returns (cube_levels, cube_index, gray_index)
+    cube_index[v] is the nearest rgb6 cube level of channel value v.
+    gray_index[r + g + b] is the nearest gray level of color (r, g, b).
+    '''
+    cube_levels = (0, 95, 135, 175, 215, 255)
+    cube_index = [min(range(6), key=lambda i: abs(cube_levels[i] - v)) for v in range(256)]
+    gray_index = [min(range(24), key=lambda i: abs(3 * (8 + 10 * i) - s)) for s in range(766)]
+    return (cube_levels, cube_index, gray_index)
+
+
+# xterm default palette of system colors
+dye16_palette = (
+        (0, 0, 0), (205, 0, 0), (0, 205, 0), (205, 205, 0),
+        (0, 0, 238), (205, 0, 205), (0, 205, 205), (229, 229, 229),
+        (127, 127, 127), (255, 0, 0), (0, 255, 0), (255, 255, 0),
+        (92, 92, 255), (255, 0, 255), (0, 255, 255), (255, 255, 255),
+        )
+
+
+def dye256_to_rgb(code):
+    if code < 16:
+        return dye16_palette[code]
+    if code >= 232:
+        return ((code - 232) * 10 + 8,) * 3
+    cube_levels = quantize_tables()[0]
+    c = code - 16
+    return (cube_levels[c // 36], cube_levels[(c % 36) // 6], cube_levels[c % 6])
+
+
+def nearest_dye16(color):
+    '''
+    Find the nearest system color code (0 - 15) of a dye256 or dyergb.
+    Only called when rendering, so a linear scan is fine.
+    '''
+    if isinstance(color, dye256):
+        if color.code < 16:
+            return color.code
+        rgb = dye256_to_rgb(color.code)
+    else:
+        rgb = (color.r, color.g, color.b)
+
+    return min(range(16), key=lambda i: sum((x - y) ** 2 for x, y in zip(rgb, dye16_palette[i])))
+
+
+def quantize(color):
+    '''
+    Find the nearest dye256 of color, which could be a dyergb or a packed 0xRRGGBB integer.
+    Only the rgb6 cube (16 - 231) and the grayscale (232 - 255) are considered,
+    as the system colors (0 - 15) vary between terminals.
+
+    Squared distance in RGB is the sum of per-channel ones, so the nearest cube color
+    is found channel by channel, and the nearest gray level is the one nearest to
+    the average of channels. Both are table lookups.
+    '''
+    if isinstance(color, int):
+        r, g, b = (color >> 16) & 0xFF, (color >> 8) & 0xFF, color & 0xFF
+    elif not color.seq:
+        return dye256(None)
+    else:
+        r, g, b = color.r, color.g, color.b
+
+    cube_levels, cube_index, gray_index = quantize_tables()
+
+    ri, gi, bi = cube_index[r], cube_index[g], cube_index[b]
+    dr, dg, db = r - cube_levels[ri], g - cube_levels[gi], b - cube_levels[bi]
+    cube_dist = dr * dr + dg * dg + db * db
+
+    k = gray_index[r + g + b]
+    level = 8 + 10 * k
+    dr, dg, db = r - level, g - level, b - level
+    gray_dist = dr * dr + dg * dg + db * db
+
+    if cube_dist <= gray_dist:
+        return dye256_pool[16 + 36 * ri + 6 * gi + bi]
+    return dye256_pool[232 + k]
+
 
 class paint:
     def __init__(self, fg=None, bg=None):
         self.fg = dye(fg)
         self.bg = dye(bg)
+        self.render()
+        paint_instances[id(self)] = self
 
+    def render(self):
         seq = ';'.join(filter(None, [
-            '38;' + self.fg.seq if self.fg.seq else None,
-            '48;' + self.bg.seq if self.bg.seq else None,
+            self.fg.fg_prefix[2:-1],
+            self.bg.bg_prefix[2:-1],
             ]))
         self.seq = '' if not seq else ('\033[' + seq + 'm')
 
+        # Precomputed for bulk coloring
+        self.reset = '\033[m' if self.seq else ''
+        self.bseq = self.seq.encode('ascii')
+        self.breset = self.reset.encode('ascii')
+
     def __repr__(self):
         return 'paint(fg={fg}, bg={bg})'.format(fg=self.fg, bg=self.bg)
 
     def __call__(self, s=''):
+        if isinstance(s, bytes_like):
+            return self.bseq + s + self.breset if self.bseq else bytes(s)
         return s if not self.seq else f'{self.seq}{s}\033[m'
 
+    def write(self, buf, data):
+        '''
+        Paint bytes-like data into buf, which is a bytearray or a binary stream.
+        Returns the number of bytes written.
+        '''
+        return write_bytes(buf, self.bseq, data, self.breset)
+
+    def map(self, iterable):
+        '''
+        Paint each item of iterable, lazily.
+        Equivalent to map(self, iterable), but each item is converted into str.
+        '''
+        seq, reset = self.seq, self.reset
+        return (f'{seq}{s}{reset}' for s in iterable)
+
+    def join(self, iterable, sep=''):
+        '''
+        Paint each item of iterable and join them with sep, the sep is not painted.
+        Equivalent to sep.join(self.map(iterable)), but builds the result in one go.
+        '''
+        items = list(map(str, iterable))
+        if not self.seq or not items:
+            return sep.join(items)
+        return self.seq + (self.reset + sep + self.seq).join(items) + self.reset
+
     def __str__(self):
-        return self.seq or '\033[m'
+        return self.seq or ('\033[m' if color_depth else '')
 
     def __or__(self, other):
         fg = other.fg if other.fg.seq else self.fg
@@ -194,7 +501,152 @@ class paint:
         return paint(fg=self.bg, bg=self.fg)
 
     def __eq__(self, other):
-        return self.seq == other.seq
+        return (self.fg.seq, self.bg.seq) == (other.fg.seq, other.bg.seq)
+
+    def __hash__(self):
+        return hash((self.fg.seq, self.bg.seq))
+
+
+class styled:
+    '''
+    Colored text, stored as (text, paint) spans instead of escape sequences.
+
+    Concatenation and slicing work on spans, so no decolor() is needed.
+    len() and slicing are measured in display columns.
+    str() renders escape sequences once, with minimal SGR transitions between spans.
+    '''
+
+    def __init__(self, text='', style=None):
+        self.spans = []
+        self.widths = []
+        if text:
+            self.append(str(text), style)
+
+    @classmethod
+    def from_spans(cls, spans):
+        ret = cls()
+        for text, style in spans:
+            ret.append(text, style)
+        return ret
+
+    def append(self, text, style=None):
+        if not text:
+            return
+
+        if style is None:
+            style = paint()
+        elif not isinstance(style, paint):
+            style = paint(fg=style)
+
+        # Merge adjacent spans with the same style
+        if self.spans and self.spans[-1][1] == style:
+            self.spans[-1] = (self.spans[-1][0] + text, style)
+            del self.widths[len(self.spans) - 1:]
+        else:
+            self.spans.append((text, style))
+
+    def span_widths(self):
+        from .lib_tui import strwidth
+        for text, style in self.spans[len(self.widths):]:
+            self.widths.append(strwidth(text))
+        return self.widths
+
+    @property
+    def text(self):
+        return ''.join(text for text, style in self.spans)
+
+    def __len__(self):
+        return sum(self.span_widths())
+
+    def __bool__(self):
+        return bool(self.spans)
+
+    def __add__(self, other):
+        if isinstance(other, str):
+            other = styled(other)
+        elif not isinstance(other, styled):
+            return NotImplemented
+
+        ret = styled.from_spans(self.spans)
+        ret.widths = list(self.widths)
+        for text, style in other.spans:
+            ret.append(text, style)
+        return ret
+
+    def __radd__(self, other):
+        if isinstance(other, str):
+            return styled(other) + self
+        return NotImplemented
+
+    def __getitem__(self, key):
+        '''
+        Slice by display column, grapheme clusters are never split.
+        A wide cluster is dropped if it does not fit into the range.
+        '''
+        if not isinstance(key, slice):
+            raise TypeError('styled indices must be slices')
+
+        start, stop, step = key.indices(len(self))
+        if step != 1:
+            raise ValueError('slice step is not supported')
+
+        from .lib_tui import graphemes
+
+        ret = styled()
+        col = 0
+        for (text, style), width in zip(self.spans, self.span_widths()):
+            if col >= stop:
+                break
+
+            if start <= col and col + width <= stop:
+                ret.append(text, style)
+
+            elif col + width > start:
+                clusters = []
+                c = col
+                for cluster, w in graphemes(text):
+                    if start <= c and c + w <= stop:
+                        clusters.append(cluster)
+                    c += w
+                ret.append(''.join(clusters), style)
+
+            col += width
+
+        return ret
+
+    def __eq__(self, other):
+        if not isinstance(other, styled):
+            return NotImplemented
+        return self.spans == other.spans
+
+    def __repr__(self):
+        return 'styled({})'.format(', '.join('({!r}, {!r})'.format(text, style) for text, style in self.spans))
+
+    def __str__(self):
+        ret = []
+        fg, bg = '', ''
+        for text, style in self.spans:
+            new_fg = style.fg.fg_prefix[2:-1]
+            new_bg = style.bg.bg_prefix[2:-1]
+
+            if (new_fg, new_bg) != (fg, bg):
+                if not new_fg and not new_bg:
+                    ret.append('\033[m')
+                else:
+                    params = []
+                    if new_fg != fg:
+                        params.append(new_fg or '39')
+                    if new_bg != bg:
+                        params.append(new_bg or '49')
+                    ret.append('\033[' + ';'.join(params) + 'm')
+                fg, bg = new_fg, new_bg
+
+            ret.append(text)
+
+        if fg or bg:
+            ret.append('\033[m')
+
+        return ''.join(ret)
 
 
 nocolor = dye()
@@ -209,15 +661,314 @@ white = dye(7)
 orange = dye(208)
 
 
-decolor_regex = re.compile('\033' + r'\[[\d;]*m')
+# ECMA-48 escape sequences, each alternative is named after the token kind
+# Common prefixes are factored out so the regex engine could skip to ESC quickly
+ansi_pattern = (
+        r'\033(?:'
+        r'\[(?:'
+        r'(?P<sgr>[\d;:]*m)'
+        r'|(?P<csi>[\x30-\x3f]*[\x20-\x2f]*[\x40-\x7e])'
+        r')'
+        r'|(?P<osc>[\]PX^_][^\007\033]*(?:\007|\033\\))'  # OSC, DCS, SOS, PM, APC
+        r'|(?P<esc>[\x20-\x2f]*[\x30-\x4f\x51-\x57\x59-\x5a\x5c\x60-\x7e])'  # Not introducers above
+        r')'
+        )
+ansi_regex = re.compile(ansi_pattern)
+ansi_regex_bytes = re.compile(ansi_pattern.encode('ascii'))
+
+# Capturing groups are not needed for decolor(), and they are costly
+ansi_strip_pattern = re.sub(r'\(\?P<\w+>', '(?:', ansi_pattern)
+ansi_strip_regex = re.compile(ansi_strip_pattern)
+ansi_strip_regex_bytes = re.compile(ansi_strip_pattern.encode('ascii'))
+
+# Unfinished escape sequence at the end of data
+ansi_partial_pattern = r'\033(?:\[[\x30-\x3f]*[\x20-\x2f]*|[\]PX^_][^\007\033]*\033?|[\x20-\x2f]*)\Z'
+ansi_partial_regex = re.compile(ansi_partial_pattern)
+ansi_partial_regex_bytes = re.compile(ansi_partial_pattern.encode('ascii'))
+
+
+def ansi_tokenize(s):
+    '''
+    Split s into (kind, text) tokens in a single pass.
+
+    kind is one of:
+        'text': printable text
+        'sgr': Select Graphic Rendition, i.e. colors, ESC [ ... m
+        'csi': Other Control Sequences, e.g. cursor movement, ESC [ K
+        'osc': Operating System Commands and other control strings, e.g. hyperlinks
+        'esc': Other escape sequences
+    '''
+    regex = ansi_regex_bytes if isinstance(s, bytes_like) else ansi_regex
+
+    pos = 0
+    for m in regex.finditer(s):
+        start = m.start()
+        if pos < start:
+            yield ('text', s[pos:start])
+        yield (m.lastgroup, m.group())
+        pos = m.end()
+
+    if pos < len(s):
+        yield ('text', s[pos:])
+
+
 def decolor(s):
-    return decolor_regex.sub('', s)
+    '''
+    Remove all escape sequences from s, not just colors.
+    '''
+    if isinstance(s, bytes_like):
+        return ansi_strip_regex_bytes.sub(b'', s)
+    return ansi_strip_regex.sub('', s)
 
 
-def gradient(A, B, N=None):
+# Longest unfinished escape sequence to hold back, longer ones are passed through as text,
+# the same as decolor() does, so a truncated control string does not hold back all data after it
+partial_limit = 4096
+
+
+def split_partial(data):
+    '''
+    Split data into (complete, partial), where partial is an unfinished escape sequence at the end.
+    '''
+    if isinstance(data, bytes):
+        esc, partial_regex = b'\033', ansi_partial_regex_bytes
+    else:
+        esc, partial_regex = '\033', ansi_partial_regex
+
+    # An unfinished control string could end with the ESC of its terminator,
+    # so the second last ESC is checked first
+    idx = data.rfind(esc)
+    for i in (data.rfind(esc, 0, idx), idx):
+        if i >= 0 and len(data) - i <= partial_limit and partial_regex.match(data, i):
+            return (data[:i], data[i:])
+
+    return (data, data[:0])
+
+
+class decolorizer:
+    '''
+    Incremental decolor() for data that comes in chunks.
+
+    An escape sequence that is cut by a chunk boundary is held back,
+    and completed by the next chunk.
+    Chunks could be str or bytes-like, but should not be mixed.
+    '''
+    def __init__(self):
+        self.pending = None
+
+    def feed(self, chunk):
+        if isinstance(chunk, bytes_like):
+            chunk = bytes(chunk)
+
+        data, self.pending = split_partial(chunk if not self.pending else self.pending + chunk)
+
+        if isinstance(data, bytes):
+            return ansi_strip_regex_bytes.sub(b'', data)
+        return ansi_strip_regex.sub('', data)
+
+    def flush(self):
+        '''
+        Returns the held back data as-is, as it never completes an escape sequence.
+        '''
+        if self.pending is None:
+            return ''
+
+        ret, self.pending = self.pending, self.pending[:0]
+        return ret
+
+
+def decolor_file(src, dst, chunk_size=1 << 16):
+    '''
+    Copy from src to dst with colors removed, in constant memory.
+    Both src and dst are file objects, could be in either text or binary mode.
+    '''
+    d = decolorizer()
+    while True:
+        chunk = src.read(chunk_size)
+        if not chunk:
+            break
+        dst.write(d.feed(chunk))
+
+    tail = d.flush()
+    if tail:
+        dst.write(tail)
+
+
+# SGR state slots, in output order: slot -> parameter that turns it off
+# Bold and faint are independent, but both are turned off by 22
+sgr_slots = {
+        'bold': '22',
+        'faint': '22',
+        'italic': '23',
+        'underline': '24',
+        'blink': '25',
+        'inverse': '27',
+        'conceal': '28',
+        'strike': '29',
+        'fg': '39',
+        'bg': '49',
+        }
+
+sgr_attr_slots = {
+        '1': 'bold', '2': 'faint',
+        '3': 'italic', '23': 'italic',
+        '4': 'underline', '21': 'underline', '24': 'underline',
+        '5': 'blink', '6': 'blink', '25': 'blink',
+        '7': 'inverse', '27': 'inverse',
+        '8': 'conceal', '28': 'conceal',
+        '9': 'strike', '29': 'strike',
+        }
+
+
+def sgr_apply(state, seq):
+    '''
+    Apply SGR sequence seq onto state, a dict of slot -> parameter.
+    Unknown parameters are kept in their own slot, which could only be turned off by reset.
+    '''
+    params = seq[2:-1].split(';')
+    i = 0
+    while i < len(params):
+        p = params[i].lstrip('0') or '0' if params[i] else '0'
+        i += 1
+
+        if p == '0':
+            state.clear()
+
+        elif p == '22':
+            state.pop('bold', None)
+            state.pop('faint', None)
+
+        elif ':' in p:
+            # Colon-separated sub-parameters, e.g. 38:5:1, 38:2::r:g:b, 4:3
+            base = p.split(':')[0]
+            slot = {'38': 'fg', '48': 'bg', '4': 'underline'}.get(base, p)
+            if p == '4:0':
+                state.pop(slot, None)
+            else:
+                state[slot] = p
+
+        elif p in sgr_attr_slots:
+            slot = sgr_attr_slots[p]
+            if p == sgr_slots[slot]:
+                state.pop(slot, None)
+            else:
+                state[slot] = p
+
+        elif p in ('39', '49'):
+            state.pop('fg' if p == '39' else 'bg', None)
+
+        elif p in ('38', '48'):
+            n = {'5': 2, '2': 4}.get(params[i] if i < len(params) else None, 0)
+            state['fg' if p == '38' else 'bg'] = ';'.join([p] + params[i:i+n])
+            i += n
+
+        elif len(p) == 2 and p[0] in '34' and p[1] in '01234567':
+            state['fg' if p[0] == '3' else 'bg'] = p
+
+        elif (len(p) == 2 and p[0] == '9' or len(p) == 3 and p[:2] == '10') and p[-1] in '01234567':
+            state['fg' if p[0] == '9' else 'bg'] = p
+
+        else:
+            state[p] = p
+
+
+def sgr_transition(old, new):
+    '''
+    Returns the shortest SGR sequence that turns state old into state new.
+    '''
+    if old == new:
+        return ''
+
+    if not new:
+        return '\033[m'
+
+    slots = [slot for slot in sgr_slots if slot in old or slot in new]
+    slots += [slot for slot in {**old, **new} if slot not in sgr_slots]
+
+    full = ['0'] + [new[slot] for slot in slots if slot in new]
+
+    # Turn off slots first, as one parameter could turn off more than one slot
+    offs = []
+    for slot in slots:
+        if slot in new:
+            pass
+        elif slot in sgr_slots:
+            if sgr_slots[slot] not in offs:
+                offs.append(sgr_slots[slot])
+        else:
+            offs = None
+            break
+
+    diff = None
+    if offs is not None:
+        diff = offs + [new[slot] for slot in slots if slot in new and
+                       (old.get(slot) != new[slot] or sgr_slots.get(slot) in offs)]
+
+    params = full if diff is None or len(';'.join(diff)) >= len(';'.join(full)) else diff
+    return '\033[' + ';'.join(params) + 'm'
+
+
+class sgr_minimizer:
+    '''
+    Incremental sgr_minimize() for data that comes in chunks.
+
+    SGR sequences are not written out until something is printed, so consecutive ones
+    are merged, and a reset followed by the same colors is dropped.
+    Other escape sequences are treated as printing, as some of them use the current colors.
+    '''
+    def __init__(self):
+        self.pending = ''
+        self.emitted = {}
+        self.state = {}
+
+    def feed(self, chunk):
+        data, self.pending = split_partial(self.pending + chunk)
+
+        ret = []
+        for kind, token in ansi_tokenize(data):
+            if kind == 'sgr':
+                sgr_apply(self.state, token)
+                continue
+
+            ret.append(sgr_transition(self.emitted, self.state))
+            self.emitted = dict(self.state)
+            ret.append(token)
+
+        return ''.join(ret)
+
+    def flush(self):
+        '''
+        Writes out the final SGR state and the held back data.
+        '''
+        ret = sgr_transition(self.emitted, self.state) + self.pending
+        self.emitted = dict(self.state)
+        self.pending = ''
+        return ret
+
+
+def sgr_minimize(s):
+    '''
+    Remove redundant SGR sequences from s, the rendered result is not changed.
+    e.g. red('a') + red('b') becomes the same as red('ab').
+    '''
+    m = sgr_minimizer()
+    return m.feed(s) + m.flush()
+
+
+def gradient(A, B, N=None, space='hsv'):
+    '''
+    Calculate gradient from A to B, with N stops.
+
+    space: 'hsv' | 'rgb' | 'oklab' | 'lab'
+        The color space to interpolate dyergb objects in.
+        dye256 objects are always interpolated within the 256-color palette.
+    '''
     if not isinstance(A, dye) or not isinstance(B, dye):
         raise TypeError('Can only calculate gradient() on dye objects')
 
+    if space not in gradient_spaces:
+        raise ValueError('Unknown color space: {}'.format(space))
+
     if N is not None and not isinstance(N, int):
         raise TypeError('N must be a integer')
 
@@ -231,7 +982,7 @@ def gradient(A, B, N=None):
         return gradient_dye256(A, B, N=N)
 
     if isinstance(A, dyergb) and isinstance(B, dyergb):
-        return gradient_rgb(A, B, N=N)
+        return gradient_rgb(A, B, N=N, space=space)
 
     return (A, B)
 
@@ -256,10 +1007,7 @@ def gradient_dye256_gray(A, B, N=None):
 def gradient_dye256_rgb(A, B, N=None):
     def color_to_rgb6(p):
         c = int(p) - 16
-        r = c // 36
-        g = (c % 36) // 6
-        b = c % 6
-        return vector(r, g, b)
+        return (c // 36, (c % 36) // 6, c % 6)
 
     def rgb6_to_color(rgb6):
         return dye256(rgb6[0] * 36 + rgb6[1] * 6 + rgb6[2] + 16)
@@ -267,18 +1015,15 @@ def gradient_dye256_rgb(A, B, N=None):
     rgb_a = color_to_rgb6(A)
     rgb_b = color_to_rgb6(B)
 
-    delta = rgb_b - rgb_a
-    cont_step_count = max(abs(d) for d in delta)
+    cont_step_count = max(abs(b - a) for a, b in zip(rgb_a, rgb_b))
 
     if N is None or N > cont_step_count:
         # N >= minimum contiguous path
-        steps = []
+        path = [rgb_a]
         for n in range(cont_step_count):
-            step = delta.map(sgn)
-            steps.append(step)
-            delta = delta.map(lambda x: x - sgn(x))
+            path.append(tuple(a + sgn(b - a) for a, b in zip(path[-1], rgb_b)))
 
-        ret = distribute(list(itertools.accumulate([rgb_a] + steps)), N)
+        ret = distribute(path, N)
 
     else:
         # N is shorter than minimum contiguous path
@@ -291,37 +1036,228 @@ def gradient_dye256_rgb(A, B, N=None):
     return tuple(rgb6_to_color(i) for i in ret)
 
 
-def gradient_rgb(A, B, N):
-    # Calculate gradient in RGB
-    # a = (A.r, A.g, A.b)
-    # b = (B.r, B.g, B.b)
-    #
-    # ret = [A]
-    # for t in (i / (N - 1) for i in range(1, N - 1)):
-    #     ret.append(dyergb(tuple(map(int, lerp(a, b, t)))))
-    # ret.append(B)
-    # return tuple(ret)
-
+def gradient_rgb(A, B, N, space='hsv'):
     if N is None:
         N = 7
 
-    # Calculate gradient in HSV
+    packed = gradient_packed(A, B, N, space=space)
+    return (A,) + tuple(dyergb(p >> 16, (p >> 8) & 0xFF, p & 0xFF) for p in packed[1:-1]) + (B,)
+
+
+@functools.lru_cache(maxsize=None)
+def load_numpy():
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        return None
+
+
+# NumPy has a setup cost, only worth it for long gradients
+gradient_numpy_threshold = 1024
+
+
+def pack_rgb(r, g, b):
+    return (int(r * 255) << 16) | (int(g * 255) << 8) | int(b * 255)
+
+
+def pack_rgb_numpy(np, r, g, b):
+    r, g, b = ((np.asarray(c) * 255).astype(np.int64) for c in (r, g, b))
+    return (r << 16) | (g << 8) | b
+
+
+@functools.lru_cache(maxsize=None)
+def srgb_tables():
+    '''
+    Returns (to_linear, thresholds)
+    to_linear[c] is the linear intensity of 8-bit sRGB value c.
+    thresholds[c] is the midpoint between to_linear[c] and to_linear[c + 1],
+    so bisect(thresholds, x) gives the nearest 8-bit sRGB value of linear intensity x.
+    '''
+    def linearize(c):
+        c = c / 255
+        return c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4
+
+    to_linear = [linearize(c) for c in range(256)]
+    thresholds = [(x + y) / 2 for x, y in zip(to_linear, to_linear[1:])]
+    return (to_linear, thresholds)
+
+
+def pack_linear_rgb(r, g, b):
+    thresholds = srgb_tables()[1]
+    return (bisect.bisect(thresholds, r) << 16) | (bisect.bisect(thresholds, g) << 8) | bisect.bisect(thresholds, b)
+
+
+def pack_linear_rgb_numpy(np, r, g, b):
+    thresholds = np.asarray(srgb_tables()[1])
+    r, g, b = (np.searchsorted(thresholds, c, side='right').astype(np.int64) for c in (r, g, b))
+    return (r << 16) | (g << 8) | b
+
+
+def gradient_space_hsv():
     import colorsys
-    a = vector(colorsys.rgb_to_hsv(A.r / 255, A.g / 255, A.b / 255))
-    b = vector(colorsys.rgb_to_hsv(B.r / 255, B.g / 255, B.b / 255))
 
-    # Choose shorter hue gradient path
-    if abs(b[0] - a[0]) > 0.5:
-        if b[0] < a[0]:
-            b[0] += 1
-        else:
-            a[0] += 1
+    def from_rgb(r, g, b):
+        return list(colorsys.rgb_to_hsv(r / 255, g / 255, b / 255))
+
+    def to_packed(h, s, v):
+        return pack_rgb(*colorsys.hsv_to_rgb(h, s, v))
+
+    def to_packed_numpy(np, h, s, v):
+        # Same arithmetic as colorsys.hsv_to_rgb(), so the results are identical
+        i = (h * 6.0).astype(int)
+        f = (h * 6.0) - i
+        p = v * (1.0 - s)
+        q = v * (1.0 - s * f)
+        t = v * (1.0 - s * (1.0 - f))
+        i = i % 6
+        return pack_rgb_numpy(np,
+                np.choose(i, [v, q, p, p, t, v]),
+                np.choose(i, [t, v, v, q, p, p]),
+                np.choose(i, [p, p, t, v, v, q]))
+
+    def adjust(a, b):
+        # Choose shorter hue gradient path
+        if abs(b[0] - a[0]) > 0.5:
+            if b[0] < a[0]:
+                b[0] += 1
+            else:
+                a[0] += 1
+
+    return (from_rgb, to_packed, to_packed_numpy, adjust)
+
+
+def gradient_space_rgb():
+    return (
+            lambda r, g, b: [r / 255, g / 255, b / 255],
+            pack_rgb,
+            pack_rgb_numpy,
+            lambda a, b: None,
+            )
+
+
+def gradient_space_oklab():
+    # https://bottosson.github.io/posts/oklab/
+    def from_rgb(r, g, b):
+        to_linear = srgb_tables()[0]
+        r, g, b = to_linear[r], to_linear[g], to_linear[b]
+        l = (0.4122214708 * r + 0.5363325363 * g + 0.0514459929 * b) ** (1 / 3)
+        m = (0.2119034982 * r + 0.6806995451 * g + 0.1073969566 * b) ** (1 / 3)
+        s = (0.0883024619 * r + 0.2817188376 * g + 0.6299787005 * b) ** (1 / 3)
+        return [
+                0.2104542553 * l + 0.7936177850 * m - 0.0040720468 * s,
+                1.9779984951 * l - 2.4285922050 * m + 0.4505937099 * s,
+                0.0259040371 * l + 0.7827717662 * m - 0.8086757660 * s,
+                ]
+
+    def to_linear_rgb(L, a, b):
+        l = L + 0.3963377774 * a + 0.2158037573 * b
+        m = L - 0.1055613458 * a - 0.0638541728 * b
+        s = L - 0.0894841775 * a - 1.2914855480 * b
+        l, m, s = l * l * l, m * m * m, s * s * s
+        return (
+                +4.0767416621 * l - 3.3077115913 * m + 0.2309699292 * s,
+                -1.2684380046 * l + 2.6097574011 * m - 0.3413193965 * s,
+                -0.0041960863 * l - 0.7034186147 * m + 1.7076147010 * s,
+                )
+
+    return (
+            from_rgb,
+            lambda L, a, b: pack_linear_rgb(*to_linear_rgb(L, a, b)),
+            lambda np, L, a, b: pack_linear_rgb_numpy(np, *to_linear_rgb(L, a, b)),
+            lambda a, b: None,
+            )
+
+
+def gradient_space_lab():
+    # CIELAB with D65 white point
+    white = (0.95047, 1.0, 1.08883)
+    delta = 6 / 29
+
+    def f(t):
+        return t ** (1 / 3) if t > delta ** 3 else t / (3 * delta * delta) + 4 / 29
+
+    def from_rgb(r, g, b):
+        to_linear = srgb_tables()[0]
+        r, g, b = to_linear[r], to_linear[g], to_linear[b]
+        x = f((0.4124564 * r + 0.3575761 * g + 0.1804375 * b) / white[0])
+        y = f((0.2126729 * r + 0.7151522 * g + 0.0721750 * b) / white[1])
+        z = f((0.0193339 * r + 0.1191920 * g + 0.9503041 * b) / white[2])
+        return [116 * y - 16, 500 * (x - y), 200 * (y - z)]
+
+    def to_linear_rgb(L, a, b, finv):
+        fy = (L + 16) / 116
+        x = finv(fy + a / 500) * white[0]
+        y = finv(fy) * white[1]
+        z = finv(fy - b / 200) * white[2]
+        return (
+                +3.2404542 * x - 1.5371385 * y - 0.4985314 * z,
+                -0.9692660 * x + 1.8760108 * y + 0.0415560 * z,
+                +0.0556434 * x - 0.2040259 * y + 1.0572252 * z,
+                )
+
+    def finv(t):
+        return t * t * t if t > delta else 3 * delta * delta * (t - 4 / 29)
+
+    def to_packed_numpy(np, L, a, b):
+        def finv_numpy(t):
+            return np.where(t > delta, t * t * t, 3 * delta * delta * (t - 4 / 29))
+        return pack_linear_rgb_numpy(np, *to_linear_rgb(L, a, b, finv_numpy))
+
+    return (
+            from_rgb,
+            lambda L, a, b: pack_linear_rgb(*to_linear_rgb(L, a, b, finv)),
+            to_packed_numpy,
+            lambda a, b: None,
+            )
+
+
+# name -> factory of (from_rgb, to_packed, to_packed_numpy, adjust)
+gradient_spaces = {
+        'hsv': gradient_space_hsv,
+        'rgb': gradient_space_rgb,
+        'oklab': gradient_space_oklab,
+        'lab': gradient_space_lab,
+        }
+
+
+def gradient_packed(A, B, N, space='hsv'):
+    '''
+    Calculate N stops of gradient from dyergb A to dyergb B, in one pass.
+    Returns an array of packed 0xRRGGBB integers.
+
+    space: 'hsv' | 'rgb' | 'oklab' | 'lab'
+        The color space to interpolate in.
 
-    ret = [A]
-    for t in (i / (N - 1) for i in range(1, N - 1)):
-        c = lerp(a, b, t)
-        ret.append(dyergb(vector(colorsys.hsv_to_rgb(*c)).map(lambda x: int(x * 255))))
+    NumPy is used for large N if it's available, otherwise a pure-Python loop does the job.
+    '''
+    import array
 
-    ret.append(B)
+    if space not in gradient_spaces:
+        raise ValueError('Unknown color space: {}'.format(space))
+
+    if N < 2:
+        raise ValueError('N={} is too small'.format(N))
+
+    from_rgb, to_packed, to_packed_numpy, adjust = gradient_spaces[space]()
+
+    a = from_rgb(A.r, A.g, A.b)
+    b = from_rgb(B.r, B.g, B.b)
+    adjust(a, b)
+    d = [y - x for x, y in zip(a, b)]
+
+    ret = array.array('L', [int(A)])
+
+    np = load_numpy() if N >= gradient_numpy_threshold else None
+    if np:
+        t = np.arange(1, N - 1) / (N - 1)
+        packed = to_packed_numpy(np, *(x + dx * t for x, dx in zip(a, d)))
+        ret.frombytes(packed.astype('u{}'.format(ret.itemsize)).tobytes())
+
+    else:
+        (a0, a1, a2), (d0, d1, d2) = a, d
+        for t in (i / (N - 1) for i in range(1, N - 1)):
+            ret.append(to_packed(a0 + d0 * t, a1 + d1 * t, a2 + d2 * t))
 
-    return tuple(ret)
+    ret.append(int(B))
+    return ret
@@ -1,11 +1,19 @@
+import codecs
+import collections
+import contextlib
+import io
+import os
 import queue
+import selectors
 import subprocess as sub
+import sys
 import threading
+import time
 
 from .lib_itertools import unwrap_one
 
 
-__all__ = ['stream', 'command', 'run', 'pipe']
+__all__ = ['stream', 'bounded', 'tail', 'command', 'run', 'arun', 'pipe']
 __all__ += ['TimeoutExpired', 'AlreadyRunningError']
 __all__ += ['RunMocker']
 
@@ -49,6 +57,66 @@ class QueueEventAdapter:
         self.Q.put(line)
 
 
+def wake_waiter(fut):
+    if not fut.done():
+        fut.set_result(None)
+
+
+class bounded:
+    '''
+    A subscriber value that bounds the buffer of a stream to [capacity] lines.
+
+    policy: what writeline() does when the buffer is full
+        'block': wait for the buffer to be consumed.
+                 Output of child processes are not read until then, so they block on the pipe.
+        'drop': drop the new line.
+        'ring': drop the oldest line.
+
+    Kept lines (stream.lines) are bounded to [capacity] lines as well,
+    with 'ring' the oldest lines are dropped, otherwise new lines are not kept.
+    Subscriber callbacks and queues still receive every line.
+    '''
+    policies = ('block', 'drop', 'ring')
+
+    def __init__(self, capacity, policy='block'):
+        if not isinstance(capacity, int) or capacity <= 0:
+            raise ValueError('Invalid capacity: {}'.format(repr(capacity)))
+
+        if policy not in self.policies:
+            raise ValueError('Invalid policy: {}'.format(repr(policy)))
+
+        self.capacity = capacity
+        self.policy = policy
+
+
+class tail:
+    '''
+    A subscriber value that keeps only the last [n] lines and/or the last [nbytes] bytes
+    of output in stream.lines, so memory stays constant regardless of output volume.
+
+    The stream buffer is bounded to the same size with the 'ring' policy,
+    unless it's bounded explicitly.
+
+    The newest line is always kept, even if it alone exceeds [nbytes].
+    '''
+    def __init__(self, n=None, nbytes=None):
+        if n is None and nbytes is None:
+            raise ValueError('Either n or nbytes should be specified')
+
+        for arg in (n, nbytes):
+            if arg is not None and (not isinstance(arg, int) or arg <= 0):
+                raise ValueError('Invalid size: {}'.format(repr(arg)))
+
+        self.n = n
+        self.nbytes = nbytes
+
+
+def line_size(line):
+    if not isinstance(line, str):
+        return len(line)
+    return len(line.encode('utf-8', 'backslashreplace')) + 1
+
+
 class stream:
     def __init__(self):
         self.queue = queue.Queue()
@@ -56,6 +124,24 @@ class stream:
         self.lines = []
         self.eof = threading.Event()
         self.hub = EventBroadcaster()
+        self.waiters_lock = threading.Lock()
+        self.waiters = []
+
+        self.capacity = None
+        self.policy = None
+        self.dropped = 0
+        self.space = threading.Condition()
+        self.space_waiters = []
+
+        self.tail = None
+        self.tail_bytes = 0
+
+        # Bytes bound of the buffer, for tail(nbytes=...)
+        self.queue_nbytes = None
+        self.queue_bytes = 0
+
+        # Items are only valid during the subscriber calls, do not keep or queue them
+        self.transient = False
 
     def welcome(self, subscriber):
         if isinstance(subscriber, (list, tuple)):
@@ -68,6 +154,12 @@ class stream:
         if subscriber is True:
             self.keep = True
 
+        elif isinstance(subscriber, bounded):
+            self.bound(subscriber.capacity, subscriber.policy)
+
+        elif isinstance(subscriber, tail):
+            self.retain(subscriber.n, subscriber.nbytes)
+
         else:
             handler = None
             if hasattr(subscriber, 'put'):
@@ -80,8 +172,64 @@ class stream:
             else:
                 raise TypeError('Invalid subscriber value: {}'.format(repr(subscriber)))
 
-    def readline(self):
-        line = self.queue.get()
+    def bound(self, capacity, policy='block'):
+        bounded(capacity, policy)
+        self.capacity = capacity
+        self.policy = policy
+
+        if self.tail:
+            pass
+        elif policy == 'ring':
+            self.lines = collections.deque(self.lines, maxlen=capacity)
+        else:
+            self.lines = self.lines[:capacity]
+
+    def retain(self, n=None, nbytes=None):
+        self.tail = tail(n, nbytes)
+        self.keep = True
+
+        if self.capacity is None:
+            # Each line takes at least 1 byte with its newline
+            self.bound(n or nbytes, 'ring')
+            self.queue_nbytes = nbytes
+
+        lines, self.lines = self.lines, collections.deque(maxlen=n)
+        self.tail_bytes = 0
+        for line in lines:
+            self.keepline(line)
+
+    def keepline(self, line):
+        lines = self.lines
+
+        if self.tail is None:
+            if self.policy == 'ring' or len(lines) < self.capacity:
+                lines.append(line)
+            return
+
+        if self.tail.nbytes is None:
+            lines.append(line)
+            return
+
+        if len(lines) == lines.maxlen:
+            self.tail_bytes -= line_size(lines.popleft())
+
+        lines.append(line)
+        self.tail_bytes += line_size(line)
+        while self.tail_bytes > self.tail.nbytes and len(lines) > 1:
+            self.tail_bytes -= line_size(lines.popleft())
+
+    @property
+    def full(self):
+        # Only a 'block' stream could be full, others make room by dropping lines
+        return self.policy == 'block' and self.queue.qsize() >= self.capacity
+
+    def readline(self, block=True):
+        line = self.queue.get(block)
+        if self.capacity is not None:
+            if self.queue_nbytes is not None and line is not None:
+                with self.space:
+                    self.queue_bytes -= line_size(line)
+            self.notify_space()
         return line
 
     def writeline(self, line, suppress=True):
@@ -90,12 +238,62 @@ class stream:
                 return
             raise BrokenPipeError('stream already closed')
 
-        if self.keep:
-            self.lines.append(line)
+        if self.transient:
+            self.hub.broadcast(line)
+            return
+
+        if self.capacity is None:
+            if self.keep:
+                self.lines.append(line)
+            self.queue.put(line)
 
-        self.queue.put(line)
+        else:
+            if self.keep:
+                self.keepline(line)
+            self.put_bounded(line)
+
+        self.notify()
         self.hub.broadcast(line)
 
+    def put_bounded(self, line):
+        if self.queue_nbytes is not None:
+            self.put_tail(line)
+
+        elif self.queue.qsize() < self.capacity:
+            self.queue.put(line)
+
+        elif self.policy == 'drop':
+            self.dropped += 1
+
+        elif self.policy == 'ring':
+            with contextlib.suppress(queue.Empty):
+                self.queue.get_nowait()
+                self.dropped += 1
+            self.queue.put(line)
+
+        else:
+            with self.space:
+                while self.full and not self.closed:
+                    self.space.wait()
+
+            if not self.closed:
+                self.queue.put(line)
+
+    def put_tail(self, line):
+        # Ring buffer bounded by both lines and bytes, the newest line is always kept
+        size = line_size(line)
+        with self.space:
+            while self.queue.qsize() and (self.queue.qsize() >= self.capacity or
+                                          self.queue_bytes + size > self.queue_nbytes):
+                try:
+                    self.queue_bytes -= line_size(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+                self.dropped += 1
+
+            self.queue.put(line)
+            self.queue_bytes += size
+
     def writelines(self, lines):
         for line in lines:
             self.writeline(line)
@@ -103,6 +301,69 @@ class stream:
     def close(self):
         self.eof.set()
         self.queue.put(None)
+        self.notify()
+        self.notify_space()
+
+    def add_waiter(self, waiter):
+        # waiter is called once, from the writer thread, on next writeline() or close()
+        with self.waiters_lock:
+            self.waiters.append(waiter)
+
+    def add_space_waiter(self, waiter):
+        # waiter is called once, from the reader thread, on next readline() or close()
+        with self.waiters_lock:
+            self.space_waiters.append(waiter)
+
+    def notify(self):
+        if not self.waiters:
+            return
+
+        with self.waiters_lock:
+            waiters, self.waiters = self.waiters, []
+
+        for waiter in waiters:
+            waiter()
+
+    def notify_space(self):
+        with self.space:
+            self.space.notify()
+
+        if not self.space_waiters:
+            return
+
+        with self.waiters_lock:
+            waiters, self.space_waiters = self.space_waiters, []
+
+        for waiter in waiters:
+            waiter()
+
+    async def wait_space(self):
+        import asyncio
+
+        while self.full and not self.closed:
+            loop = asyncio.get_running_loop()
+            fut = loop.create_future()
+            self.add_space_waiter(lambda: loop.call_soon_threadsafe(wake_waiter, fut))
+
+            if self.full and not self.closed:
+                await fut
+
+    async def areadline(self):
+        import asyncio
+
+        while True:
+            try:
+                return self.readline(block=False)
+            except queue.Empty:
+                pass
+
+            loop = asyncio.get_running_loop()
+            fut = loop.create_future()
+            self.add_waiter(lambda: loop.call_soon_threadsafe(wake_waiter, fut))
+
+            # Check again, in case the line came in before the waiter is registered
+            if self.queue.empty():
+                await fut
 
     @property
     def closed(self):
@@ -129,6 +390,462 @@ class stream:
                     break
                 yield line
 
+    async def __aiter__(self):
+        if self.closed:
+            for line in self.lines:
+                yield line
+
+        else:
+            while True:
+                line = await self.areadline()
+                if line is None:
+                    break
+                yield line
+
+
+class DeliveryPool:
+    '''
+    Runs stream deliveries in a few shared threads.
+
+    A delivery is run by one worker at a time, so lines of a stream stay in order.
+    Another worker is started only if ready deliveries wait for [stall] seconds,
+    i.e. all workers are held by subscribers, which could wait for each other.
+    Workers stop after being idle for [linger] seconds.
+    '''
+    stall = 0.05
+    linger = 1
+
+    def __init__(self):
+        self.lock = threading.Condition()
+        self.ready = collections.deque()
+        self.workers = 0
+        self.idle = 0
+
+    def schedule(self, delivery):
+        with self.lock:
+            self.ready.append((time.monotonic(), delivery))
+            if self.idle:
+                self.lock.notify()
+            elif not self.workers:
+                self.spawn()
+
+    def check(self):
+        # Start a worker if deliveries are stalled
+        # Returns seconds until next check, or None if nothing is waiting
+        with self.lock:
+            if not self.ready:
+                return None
+
+            waited = time.monotonic() - self.ready[0][0]
+            if waited < self.stall:
+                return self.stall - waited
+
+            if not self.idle:
+                self.spawn()
+            return self.stall
+
+    def spawn(self):
+        # Counted as idle until it takes a delivery, so it's not spawned twice
+        self.workers += 1
+        self.idle += 1
+        t = threading.Thread(target=self.run)
+        t.daemon = True
+        t.start()
+
+    def run(self):
+        while True:
+            with self.lock:
+                while not self.ready:
+                    if not self.lock.wait(self.linger) and not self.ready:
+                        self.workers -= 1
+                        self.idle -= 1
+                        return
+
+                _, delivery = self.ready.popleft()
+                self.idle -= 1
+
+            delivery.run()
+
+            with self.lock:
+                self.idle += 1
+
+
+delivery_pool = DeliveryPool()
+
+
+class StreamDelivery:
+    '''
+    Writes lines into a stream in the delivery pool, so subscribers that block
+    do not stall the I/O thread, and pipes of other commands.
+
+    Lines are handed over in batches, full is set when [limit] lines are not yet delivered.
+    '''
+    def __init__(self, self_stream, limit, pool=delivery_pool):
+        self.stream = self_stream
+        self.limit = limit
+        self.pool = pool
+        self.lock = threading.Lock()
+        self.batches = collections.deque()
+        self.scheduled = False
+        self.pending = 0
+        self.waiters = []
+        self.broken = False
+
+    @property
+    def full(self):
+        return self.pending >= self.limit
+
+    def add_space_waiter(self, waiter):
+        with self.lock:
+            self.waiters.append(waiter)
+
+    def put(self, batch):
+        with self.lock:
+            self.batches.append(batch)
+            if batch is not None:
+                self.pending += len(batch)
+
+            if self.scheduled:
+                return
+            self.scheduled = True
+
+        self.pool.schedule(self)
+
+    def writelines(self, lines):
+        self.put(lines)
+
+    def close(self, drain=True):
+        # If not drain, the stream is closed right away, so a blocked writeline() returns
+        if not drain and not self.stream.closed:
+            self.stream.close()
+        self.put(None)
+
+    def run(self):
+        # Deliver one batch, and reschedule for the rest, so other streams get their turn
+        with self.lock:
+            lines = self.batches.popleft()
+
+        if lines is None:
+            if not self.stream.closed:
+                self.stream.close()
+            lines = []
+
+        elif not self.broken:
+            try:
+                for line in lines:
+                    self.stream.writeline(line)
+            except Exception:
+                # Report once, and drain the rest of output so the command could finish
+                sys.excepthook(*sys.exc_info())
+                self.broken = True
+
+        with self.lock:
+            self.pending -= len(lines)
+            waiters, self.waiters = self.waiters, []
+            self.scheduled = reschedule = bool(self.batches)
+
+        for waiter in waiters:
+            waiter()
+
+        if reschedule:
+            self.pool.schedule(self)
+
+
+class LineDecoder:
+    # Decode and split lines the same way as text mode Popen, i.e. utf-8 with universal newlines
+    def __init__(self, newline):
+        self.newline = newline
+        self.decoder = io.IncrementalNewlineDecoder(
+                codecs.getincrementaldecoder('utf-8')(errors='backslashreplace'),
+                translate=True)
+        self.partial = ''
+
+    def decode(self, data, final=False):
+        # Returns complete lines in data, the last partial line is returned if final is set
+        lines = (self.partial + self.decoder.decode(data, final=final)).split('\n')
+        self.partial = lines.pop()
+        if final and self.partial:
+            lines.append(self.partial)
+            self.partial = ''
+
+        if self.newline != '\n':
+            lines = [(line + '\n').rstrip(self.newline) for line in lines]
+        return lines
+
+
+class PipeReader:
+    # Lines read ahead of subscribers
+    delivery_limit = 1024
+
+    def __init__(self, mux, fileobj, self_stream, newline):
+        self.mux = mux
+        self.fileobj = fileobj
+        self.fd = fileobj.fileno()
+
+        # Subscribers are called outside of the I/O thread
+        if self_stream.hub.handlers:
+            self_stream = StreamDelivery(self_stream, self.delivery_limit)
+        self.stream = self_stream
+        self.decoder = LineDecoder(newline)
+        self.backlog = collections.deque()
+        self.registered = False
+        self.eof = False
+
+    def open(self):
+        os.set_blocking(self.fd, False)
+        self.watch(True)
+
+    def watch(self, on):
+        if on and not self.registered:
+            self.mux.selector.register(self.fd, selectors.EVENT_READ, self)
+        elif not on and self.registered:
+            self.mux.selector.unregister(self.fd)
+        self.registered = on
+
+    def on_event(self, mask):
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return
+
+        if not data:
+            self.eof = True
+        self.backlog.extend(self.decoder.decode(data, final=self.eof))
+
+        self.flush()
+
+    def wake(self):
+        self.mux.call(self.flush)
+
+    def flush(self):
+        if self.fileobj.closed:
+            return
+
+        stream = self.stream
+        while True:
+            if stream.full:
+                # Stop reading the pipe until the stream is consumed
+                self.watch(False)
+                stream.add_space_waiter(self.wake)
+                if stream.full:
+                    return
+
+            if not self.backlog:
+                break
+
+            if isinstance(stream, StreamDelivery):
+                stream.writelines(self.backlog)
+                self.backlog = collections.deque()
+            else:
+                stream.writeline(self.backlog.popleft())
+
+        if self.eof:
+            self.close(drain=True)
+        else:
+            self.watch(True)
+
+    def close(self, drain=False):
+        # Closed without drain by kill() or errors, lines not yet delivered are dropped
+        self.watch(False)
+        self.mux.channels.pop(self.fileobj, None)
+        self.fileobj.close()
+        self.backlog.clear()
+
+        if isinstance(self.stream, StreamDelivery):
+            self.stream.close(drain=drain)
+        elif not self.stream.closed:
+            self.stream.close()
+
+
+class ChunkReader(PipeReader):
+    # Pass output through as is, without decoding and line splitting
+    def __init__(self, mux, fileobj, self_stream, mode):
+        # 'chunks' mode reads into one reusable buffer, and passes memoryviews of it,
+        # so the next read waits for the chunk to be delivered
+        self.delivery_limit = 1 if mode == 'chunks' else 16
+        super().__init__(mux, fileobj, self_stream, None)
+
+        self.buffer = bytearray(1 << 16) if mode == 'chunks' else None
+
+    def on_event(self, mask):
+        try:
+            if self.buffer is None:
+                data = os.read(self.fd, 1 << 16)
+            else:
+                data = memoryview(self.buffer)[:os.readv(self.fd, [self.buffer])]
+        except BlockingIOError:
+            return
+
+        if data:
+            self.backlog.append(data)
+        else:
+            self.eof = True
+
+        self.flush()
+
+
+class PipeWriter:
+    def __init__(self, mux, fileobj, self_stream, newline, binary=False):
+        self.mux = mux
+        self.fileobj = fileobj
+        self.fd = fileobj.fileno()
+        self.stream = self_stream
+        self.newline = newline
+        self.binary = binary
+        self.buffer = bytearray()
+        self.events = 0
+        self.eof = False
+
+    def open(self):
+        os.set_blocking(self.fd, False)
+        self.pull()
+
+    def watch(self, events):
+        if events == self.events:
+            return
+
+        if not events:
+            self.mux.selector.unregister(self.fd)
+        elif self.events:
+            self.mux.selector.modify(self.fd, events, self)
+        else:
+            self.mux.selector.register(self.fd, events, self)
+        self.events = events
+
+    def wake(self):
+        self.mux.call(self.pull)
+
+    def pull(self):
+        while not self.fileobj.closed:
+            while not self.eof:
+                try:
+                    line = self.stream.readline(block=False)
+                except queue.Empty:
+                    break
+
+                if line is None:
+                    self.eof = True
+                elif self.binary:
+                    self.buffer += line
+                else:
+                    self.buffer += (line + self.newline).encode('utf-8')
+
+            if self.buffer:
+                self.watch(selectors.EVENT_WRITE)
+                return
+
+            if self.eof:
+                self.close()
+                return
+
+            self.watch(0)
+            self.stream.add_waiter(self.wake)
+
+            # Check again, in case the line came in before the waiter is registered
+            if self.stream.queue.empty():
+                return
+
+    def on_event(self, mask):
+        try:
+            n = os.write(self.fd, self.buffer)
+        except BlockingIOError:
+            return
+        except OSError:
+            # Child process closed its stdin
+            self.buffer.clear()
+            self.close()
+            return
+
+        del self.buffer[:n]
+        if not self.buffer:
+            self.pull()
+
+    def close(self):
+        self.watch(0)
+        self.mux.channels.pop(self.fileobj)
+        self.fileobj.close()
+
+
+class IOMultiplexer:
+    '''
+    Reads and writes the pipes of all running commands in one thread.
+
+    The thread is started on demand, and stops when there is no pipe left.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread = None
+        self.selector = None
+        self.wakeup = None
+        self.pending = []
+        self.channels = {}
+
+    def call(self, func):
+        # Run func in the I/O thread
+        with self.lock:
+            self.pending.append(func)
+
+            if not self.thread:
+                self.selector = selectors.DefaultSelector()
+                self.wakeup = os.pipe()
+                for fd in self.wakeup:
+                    os.set_blocking(fd, False)
+                self.selector.register(self.wakeup[0], selectors.EVENT_READ, None)
+
+                self.thread = threading.Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+
+            with contextlib.suppress(BlockingIOError):
+                os.write(self.wakeup[1], b'\0')
+
+    def open(self, channel):
+        def open_channel():
+            self.channels[channel.fileobj] = channel
+            channel.open()
+        self.call(open_channel)
+
+    def close(self, fileobj):
+        def close_channel():
+            if fileobj in self.channels:
+                self.channels[fileobj].close()
+        self.call(close_channel)
+
+    def dispatch(self, func, channel=None):
+        try:
+            func()
+        except Exception:
+            # Errors from one pipe should not stop pipes of other commands
+            sys.excepthook(*sys.exc_info())
+            if channel is not None and channel.fileobj in self.channels:
+                with contextlib.suppress(Exception):
+                    channel.close()
+
+    def run(self):
+        while True:
+            for key, mask in self.selector.select(delivery_pool.check()):
+                if key.data is None:
+                    with contextlib.suppress(BlockingIOError):
+                        os.read(key.fd, 4096)
+                else:
+                    self.dispatch(lambda: key.data.on_event(mask), key.data)
+
+            with self.lock:
+                pending, self.pending = self.pending, []
+                # Stalled deliveries are checked in this thread too
+                if not pending and not self.channels and not delivery_pool.ready:
+                    self.selector.close()
+                    for fd in self.wakeup:
+                        os.close(fd)
+                    self.thread = None
+                    return
+
+            for func in pending:
+                self.dispatch(func)
+
+
+io_multiplexer = IOMultiplexer()
+
 
 class command:
     '''
@@ -147,7 +864,7 @@ class command:
 
         If a Queue is provided, stdin.task_done() will be called for each item.
 
-    stdout: None | False | True | callable[str] | Queue
+    stdout: None | False | True | callable[str] | Queue | bounded | tail
         The stdout "subscribers".
         Default: True.
 
@@ -155,11 +872,13 @@ class command:
         If set to ``None``, stdout will be left as-is (most likely to the tty).
         If set to other falsy-values, stdout will be silently dropped.
         If set to ``Queue`` object, each line will be put into the queue object.
+        If set to a ``bounded`` object, the stream buffer will be bounded.
+        If set to a ``tail`` object, only the last lines will be kept.
 
         Multiple objects could be provided at once for output duplication.
         E.g. tuple(print, queue.Queue())
 
-    stderr: None | False | True | callable[str] | Queue
+    stderr: None | False | True | callable[str] | Queue | bounded | tail
         The stderr "subscribers".
         Default: True.
 
@@ -167,38 +886,59 @@ class command:
         If set to ``None``, stderr will be left as-is (most likely to the tty).
         If set to ``False``, stderr will be silently dropped.
         If set to ``Queue`` object, each line will be put into the queue object.
+        If set to a ``bounded`` object, the stream buffer will be bounded.
+        If set to a ``tail`` object, only the last lines will be kept.
 
         Multiple objects could be provided at once for output duplication.
         E.g. tuple(print, queue.Queue())
 
     env: dict[str, str]:
         The environment variables.
+
+    mode: 'lines' | 'bytes' | 'chunks'
+        The unit of data that streams deliver.
+        Default: 'lines'.
+
+        If set to ``'lines'``, streams deliver decoded lines without trailing newline.
+        If set to ``'bytes'``, streams deliver ``bytes`` chunks as read from the pipes,
+        and stdin items are written as-is.
+        If set to ``'chunks'``, streams deliver ``memoryview`` of a reused buffer,
+        which is only valid during the subscriber call, so they are not kept nor queued.
+        stdout and stderr subscribers could only be callables, or ``None`` / ``False``.
+        ``'chunks'`` only applies to external commands run by run().
     '''
 
+    modes = ('lines', 'bytes', 'chunks')
+
     def __init__(self, *cmd,
             stdin=None, stdout=True, stderr=True,
-            newline='\n', env=None):
+            newline='\n', env=None, mode='lines'):
 
         cmd = unwrap_one(cmd)
 
         if not cmd:
             raise ValueError('command is empty')
 
+        if mode not in self.modes:
+            raise ValueError('Invalid mode: {}'.format(repr(mode)))
+
         if callable(cmd[0]):
             self.cmd = [token for token in cmd]
         else:
             self.cmd = [str(token) for token in cmd]
 
         self.newline = newline
+        self.mode = mode
 
         self.env = env
         self.proc = None
         self.thread = None
+        self.tasks = []
         self.exception = None
         self.killed = threading.Event()
         self.returncode = None
 
-        if isinstance(stdin, str):
+        if isinstance(stdin, (str, bytes)):
             stdin = [stdin]
 
         # Initialize stdin stream
@@ -238,7 +978,12 @@ class command:
             self.stderr.keep = False
             self.stderr.welcome(stderr)
 
-        self.io_threads = []
+        if mode == 'chunks':
+            for name, self_stream in (('stdout', self.stdout), ('stderr', self.stderr)):
+                if self_stream.keep or self_stream.capacity is not None or any(
+                        isinstance(handler, QueueEventAdapter) for handler in self_stream.hub.handlers):
+                    raise ValueError("{} could not be kept or queued in 'chunks' mode".format(name))
+                self_stream.transient = True
 
     def __getitem__(self, idx):
         return [self.stdin, self.stdout, self.stderr][idx]
@@ -253,7 +998,7 @@ class command:
         self.wait()
 
     def run(self, wait=True, timeout=None):
-        if self.proc or self.thread:
+        if self.proc or self.thread or self.tasks:
             raise AlreadyRunningError(self)
 
         if callable(self.cmd[0]):
@@ -272,62 +1017,165 @@ class command:
             self.thread.start()
 
         else:
+            # Pipes of all commands are handled by the I/O multiplexer thread
             self.proc = sub.Popen(
                     self.cmd,
                     stdin=self.proc_stdin,
                     stdout=self.proc_stdout,
                     stderr=self.proc_stderr,
-                    encoding='utf-8', errors='backslashreplace',
-                    bufsize=1, universal_newlines=True,
                     env=self.env)
 
-            def writer(self_stream, proc_stream):
-                for line in self_stream:
-                    proc_stream.write(line + self.newline)
-                    proc_stream.flush()
-                proc_stream.close()
+            if self.proc.stdin:
+                io_multiplexer.open(PipeWriter(io_multiplexer, self.proc.stdin, self.stdin,
+                                               self.newline, binary=(self.mode != 'lines')))
 
-            def reader(self_stream, proc_stream):
-                for line in proc_stream:
-                    line = line.rstrip(self.newline)
-                    self_stream.writeline(line)
-                self_stream.close()
+            for (self_stream, proc_stream) in (
+                    (self.stdout, self.proc.stdout),
+                    (self.stderr, self.proc.stderr),
+                    ):
+                if not proc_stream:
+                    continue
+
+                if self.mode == 'lines':
+                    channel = PipeReader(io_multiplexer, proc_stream, self_stream, self.newline)
+                else:
+                    channel = ChunkReader(io_multiplexer, proc_stream, self_stream, self.mode)
+                io_multiplexer.open(channel)
+
+        self.feed_stdin(threaded=not isinstance(self.user_stdin, (list, tuple)))
+
+        if wait or timeout:
+            self.wait(timeout)
+
+        return self
+
+    def feed_stdin(self, threaded=True):
+        # Feed user stdin and close the stream
+        if self.user_stdin is True:
+            return
+
+        def feeder():
+            if isinstance(self.user_stdin, queue.Queue):
+                while True:
+                    self.stdin.writeline(self.user_stdin.get())
+                    self.user_stdin.task_done()
+
+            else:
+                for line in self.user_stdin:
+                    self.stdin.writeline(line)
+                self.stdin.close()
+
+        # Queue.get() blocks, so it always needs a thread
+        if not threaded and not isinstance(self.user_stdin, queue.Queue):
+            feeder()
+            return
+
+        t = threading.Thread(target=feeder)
+        t.daemon = True
+        t.start()
+
+    async def arun(self, wait=True, timeout=None):
+        '''
+        Same as run(), but the child process is driven by the running asyncio event loop,
+        without I/O threads. Callables are still run in a thread.
+
+        With 'chunks' mode, subscribers get ``bytes`` chunks instead of ``memoryview``,
+        as asyncio does not read into user buffers. They are still not kept nor queued.
+
+        If wait is False, the command object could be awaited later.
+        '''
+        import asyncio
+
+        if self.proc or self.thread or self.tasks:
+            raise AlreadyRunningError(self)
+
+        if callable(self.cmd[0]):
+            self.run(wait=False)
+            self.tasks.append(asyncio.get_running_loop().run_in_executor(None, self.wait))
+
+        else:
+            self.proc = await asyncio.create_subprocess_exec(
+                    *self.cmd,
+                    stdin=self.proc_stdin,
+                    stdout=self.proc_stdout,
+                    stderr=self.proc_stderr,
+                    env=self.env)
+
+            async def writer(self_stream, proc_stream):
+                try:
+                    async for line in self_stream:
+                        if self.mode == 'lines':
+                            line = (line + self.newline).encode('utf-8')
+                        proc_stream.write(line)
+                        await proc_stream.drain()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
                 proc_stream.close()
 
+            async def reader(self_stream, proc_stream):
+                decoder = LineDecoder(self.newline)
+                while True:
+                    data = await proc_stream.read(1 << 16)
+                    if self.mode == 'lines':
+                        lines = decoder.decode(data, final=not data)
+                    else:
+                        lines = [data] if data else []
+
+                    for line in lines:
+                        if self_stream.full:
+                            await self_stream.wait_space()
+                        self_stream.writeline(line)
+
+                    if not data:
+                        break
+
+                if not self_stream.closed:
+                    self_stream.close()
+
+            io = []
             for (worker, self_stream, proc_stream) in (
                     (writer, self.stdin, self.proc.stdin),
                     (reader, self.stdout, self.proc.stdout),
                     (reader, self.stderr, self.proc.stderr),
                     ):
                 if self_stream is not None and proc_stream is not None:
-                    t = threading.Thread(target=worker, args=(self_stream, proc_stream))
-                    t.daemon = True
-                    t.start()
-                    self.io_threads.append(t)
-
-        # Feed user stdin and close the stream
-        if self.user_stdin is not True:
-            def feeder():
-                if isinstance(self.user_stdin, queue.Queue):
-                    while True:
-                        self.stdin.writeline(self.user_stdin.get())
-                        self.user_stdin.task_done()
+                    io.append(worker(self_stream, proc_stream))
 
-                else:
-                    for line in self.user_stdin:
-                        self.stdin.writeline(line)
-                    self.stdin.close()
+            async def communicate():
+                await asyncio.gather(*io)
+                self.returncode = await self.proc.wait()
 
-            t = threading.Thread(target=feeder)
-            t.daemon = True
-            t.start()
+            self.tasks.append(asyncio.ensure_future(communicate()))
+            self.feed_stdin(threaded=False)
 
         if wait or timeout:
-            self.wait(timeout)
+            await self.async_wait(timeout)
 
         return self
 
+    async def async_wait(self, timeout=None):
+        import asyncio
+
+        if not self.tasks:
+            return
+
+        done, pending = await asyncio.wait(self.tasks, timeout=timeout)
+        if pending:
+            raise TimeoutExpired(self.cmd, timeout)
+
+        for task in done:
+            task.result()
+
+        if self.exception:
+            raise self.exception
+
+    def __await__(self):
+        return self.async_wait().__await__()
+
     def wait(self, timeout=None):
+        if self.tasks and not self.thread:
+            raise RuntimeError('Command is run by arun(), await it instead')
+
         # Wait for child process to finish
         if self.proc:
             self.proc.wait(timeout)
@@ -348,11 +1196,18 @@ class command:
         self.stdout.eof.wait()
         self.stderr.eof.wait()
 
-        # Gracefully wait for threads to finish
-        for t in self.io_threads:
-            t.join()
-
     def kill(self):
+        if self.proc and self.tasks:
+            # Reaped by the event loop
+            if self.proc.returncode is None:
+                self.proc.kill()
+
+            # Release I/O tasks that wait for stdin or space in bounded streams
+            for self_stream in (self.stdin, self.stdout, self.stderr):
+                if not self_stream.closed:
+                    self_stream.close()
+            return
+
         if self.proc:
             self.proc.kill()
             self.proc.wait()
@@ -362,7 +1217,7 @@ class command:
                     self.proc.stderr
                     ):
                 if proc_stream:
-                    proc_stream.close()
+                    io_multiplexer.close(proc_stream)
 
             self.returncode = self.proc.returncode
 
@@ -371,12 +1226,18 @@ class command:
             self.thread.join()
 
 
-def run(*cmd, stdin=None, stdout=True, stderr=True, newline='\n', env=None, wait=True, timeout=None):
-    ret = command(*cmd, stdin=stdin, stdout=stdout, stderr=stderr, newline=newline, env=env)
+def run(*cmd, stdin=None, stdout=True, stderr=True, newline='\n', env=None, mode='lines', wait=True, timeout=None):
+    ret = command(*cmd, stdin=stdin, stdout=stdout, stderr=stderr, newline=newline, env=env, mode=mode)
     ret.run(wait=wait, timeout=timeout)
     return ret
 
 
+async def arun(*cmd, stdin=None, stdout=True, stderr=True, newline='\n', env=None, mode='lines', wait=True, timeout=None):
+    ret = command(*cmd, stdin=stdin, stdout=stdout, stderr=stderr, newline=newline, env=env, mode=mode)
+    await ret.arun(wait=wait, timeout=timeout)
+    return ret
+
+
 def pipe(istream, *ostreams):
     if istream.closed:
         raise EOFError('istream already closed')
@@ -449,7 +1310,7 @@ class RunMocker:
 
         return args
 
-    def __call__(self, cmd, stdin=None, stdout=True, stderr=True, newline='\n', env=None, wait=True, timeout=None):
+    def __call__(self, cmd, stdin=None, stdout=True, stderr=True, newline='\n', env=None, mode='lines', wait=True, timeout=None):
         matched_pattern = None
         matched_args = []
         for rule in self.rules.items():
@@ -478,6 +1339,6 @@ class RunMocker:
         if len(matched_callbacks) > 1:
             matched_callbacks.pop(0)
 
-        p = command([callback] + matched_args, stdin=stdin, stdout=stdout, stderr=stderr, newline=newline, env=env)
+        p = command([callback] + matched_args, stdin=stdin, stdout=stdout, stderr=stderr, newline=newline, env=env, mode=mode)
         p.run(wait=wait, timeout=timeout)
         return p
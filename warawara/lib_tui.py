@@ -1,24 +1,283 @@
+import bisect
+import collections
 import contextlib
 import enum
+import functools
 import itertools
 import re
 import sys
 import threading
 import time
-import unicodedata
 
 from . import lib_paints as paints
 
-from .lib_itertools import zip_longest, unwrap_one, flatten
-from .lib_paints import decolor
+from .lib_itertools import unwrap_one, flatten
+from .lib_paints import decolor, ansi_tokenize
+
+
+__all__ = ['strwidth', 'ljust', 'rjust', 'table']
+__all__ += ['ThreadedSpinner', 'ProgressBar', 'Progress', 'prompt']
+
+
+# (first, last, width) of code point ranges that are not 1 column wide,
+# generated from unicodedata 14.0.0:
+# * Mn, Me, Cf (except U+00AD) and Hangul medial vowels / final consonants are 0
+# * East Asian Wide / Fullwidth, and the CJK ideograph blocks are 2
+# Unassigned code points are merged into neighboring ranges.
+width_table = (
+        (0x0300, 0x036f, 0), (0x0483, 0x0489, 0), (0x0591, 0x05bd, 0), (0x05bf, 0x05bf, 0),
+        (0x05c1, 0x05c2, 0), (0x05c4, 0x05c5, 0), (0x05c7, 0x05c7, 0), (0x0600, 0x0605, 0),
+        (0x0610, 0x061a, 0), (0x061c, 0x061c, 0), (0x064b, 0x065f, 0), (0x0670, 0x0670, 0),
+        (0x06d6, 0x06dd, 0), (0x06df, 0x06e4, 0), (0x06e7, 0x06e8, 0), (0x06ea, 0x06ed, 0),
+        (0x070f, 0x070f, 0), (0x0711, 0x0711, 0), (0x0730, 0x074a, 0), (0x07a6, 0x07b0, 0),
+        (0x07eb, 0x07f3, 0), (0x07fd, 0x07fd, 0), (0x0816, 0x0819, 0), (0x081b, 0x0823, 0),
+        (0x0825, 0x0827, 0), (0x0829, 0x082d, 0), (0x0859, 0x085b, 0), (0x0890, 0x089f, 0),
+        (0x08ca, 0x0902, 0), (0x093a, 0x093a, 0), (0x093c, 0x093c, 0), (0x0941, 0x0948, 0),
+        (0x094d, 0x094d, 0), (0x0951, 0x0957, 0), (0x0962, 0x0963, 0), (0x0981, 0x0981, 0),
+        (0x09bc, 0x09bc, 0), (0x09c1, 0x09c4, 0), (0x09cd, 0x09cd, 0), (0x09e2, 0x09e3, 0),
+        (0x09fe, 0x0a02, 0), (0x0a3c, 0x0a3c, 0), (0x0a41, 0x0a51, 0), (0x0a70, 0x0a71, 0),
+        (0x0a75, 0x0a75, 0), (0x0a81, 0x0a82, 0), (0x0abc, 0x0abc, 0), (0x0ac1, 0x0ac8, 0),
+        (0x0acd, 0x0acd, 0), (0x0ae2, 0x0ae3, 0), (0x0afa, 0x0b01, 0), (0x0b3c, 0x0b3c, 0),
+        (0x0b3f, 0x0b3f, 0), (0x0b41, 0x0b44, 0), (0x0b4d, 0x0b56, 0), (0x0b62, 0x0b63, 0),
+        (0x0b82, 0x0b82, 0), (0x0bc0, 0x0bc0, 0), (0x0bcd, 0x0bcd, 0), (0x0c00, 0x0c00, 0),
+        (0x0c04, 0x0c04, 0), (0x0c3c, 0x0c3c, 0), (0x0c3e, 0x0c40, 0), (0x0c46, 0x0c56, 0),
+        (0x0c62, 0x0c63, 0), (0x0c81, 0x0c81, 0), (0x0cbc, 0x0cbc, 0), (0x0cbf, 0x0cbf, 0),
+        (0x0cc6, 0x0cc6, 0), (0x0ccc, 0x0ccd, 0), (0x0ce2, 0x0ce3, 0), (0x0d00, 0x0d01, 0),
+        (0x0d3b, 0x0d3c, 0), (0x0d41, 0x0d44, 0), (0x0d4d, 0x0d4d, 0), (0x0d62, 0x0d63, 0),
+        (0x0d81, 0x0d81, 0), (0x0dca, 0x0dca, 0), (0x0dd2, 0x0dd6, 0), (0x0e31, 0x0e31, 0),
+        (0x0e34, 0x0e3a, 0), (0x0e47, 0x0e4e, 0), (0x0eb1, 0x0eb1, 0), (0x0eb4, 0x0ebc, 0),
+        (0x0ec8, 0x0ecd, 0), (0x0f18, 0x0f19, 0), (0x0f35, 0x0f35, 0), (0x0f37, 0x0f37, 0),
+        (0x0f39, 0x0f39, 0), (0x0f71, 0x0f7e, 0), (0x0f80, 0x0f84, 0), (0x0f86, 0x0f87, 0),
+        (0x0f8d, 0x0fbc, 0), (0x0fc6, 0x0fc6, 0), (0x102d, 0x1030, 0), (0x1032, 0x1037, 0),
+        (0x1039, 0x103a, 0), (0x103d, 0x103e, 0), (0x1058, 0x1059, 0), (0x105e, 0x1060, 0),
+        (0x1071, 0x1074, 0), (0x1082, 0x1082, 0), (0x1085, 0x1086, 0), (0x108d, 0x108d, 0),
+        (0x109d, 0x109d, 0), (0x1100, 0x115f, 2), (0x1160, 0x11ff, 0), (0x135d, 0x135f, 0),
+        (0x1712, 0x1714, 0), (0x1732, 0x1733, 0), (0x1752, 0x1753, 0), (0x1772, 0x1773, 0),
+        (0x17b4, 0x17b5, 0), (0x17b7, 0x17bd, 0), (0x17c6, 0x17c6, 0), (0x17c9, 0x17d3, 0),
+        (0x17dd, 0x17dd, 0), (0x180b, 0x180f, 0), (0x1885, 0x1886, 0), (0x18a9, 0x18a9, 0),
+        (0x1920, 0x1922, 0), (0x1927, 0x1928, 0), (0x1932, 0x1932, 0), (0x1939, 0x193b, 0),
+        (0x1a17, 0x1a18, 0), (0x1a1b, 0x1a1b, 0), (0x1a56, 0x1a56, 0), (0x1a58, 0x1a60, 0),
+        (0x1a62, 0x1a62, 0), (0x1a65, 0x1a6c, 0), (0x1a73, 0x1a7f, 0), (0x1ab0, 0x1b03, 0),
+        (0x1b34, 0x1b34, 0), (0x1b36, 0x1b3a, 0), (0x1b3c, 0x1b3c, 0), (0x1b42, 0x1b42, 0),
+        (0x1b6b, 0x1b73, 0), (0x1b80, 0x1b81, 0), (0x1ba2, 0x1ba5, 0), (0x1ba8, 0x1ba9, 0),
+        (0x1bab, 0x1bad, 0), (0x1be6, 0x1be6, 0), (0x1be8, 0x1be9, 0), (0x1bed, 0x1bed, 0),
+        (0x1bef, 0x1bf1, 0), (0x1c2c, 0x1c33, 0), (0x1c36, 0x1c37, 0), (0x1cd0, 0x1cd2, 0),
+        (0x1cd4, 0x1ce0, 0), (0x1ce2, 0x1ce8, 0), (0x1ced, 0x1ced, 0), (0x1cf4, 0x1cf4, 0),
+        (0x1cf8, 0x1cf9, 0), (0x1dc0, 0x1dff, 0), (0x200b, 0x200f, 0), (0x202a, 0x202e, 0),
+        (0x2060, 0x206f, 0), (0x20d0, 0x20f0, 0), (0x231a, 0x231b, 2), (0x2329, 0x232a, 2),
+        (0x23e9, 0x23ec, 2), (0x23f0, 0x23f0, 2), (0x23f3, 0x23f3, 2), (0x25fd, 0x25fe, 2),
+        (0x2614, 0x2615, 2), (0x2648, 0x2653, 2), (0x267f, 0x267f, 2), (0x2693, 0x2693, 2),
+        (0x26a1, 0x26a1, 2), (0x26aa, 0x26ab, 2), (0x26bd, 0x26be, 2), (0x26c4, 0x26c5, 2),
+        (0x26ce, 0x26ce, 2), (0x26d4, 0x26d4, 2), (0x26ea, 0x26ea, 2), (0x26f2, 0x26f3, 2),
+        (0x26f5, 0x26f5, 2), (0x26fa, 0x26fa, 2), (0x26fd, 0x26fd, 2), (0x2705, 0x2705, 2),
+        (0x270a, 0x270b, 2), (0x2728, 0x2728, 2), (0x274c, 0x274c, 2), (0x274e, 0x274e, 2),
+        (0x2753, 0x2755, 2), (0x2757, 0x2757, 2), (0x2795, 0x2797, 2), (0x27b0, 0x27b0, 2),
+        (0x27bf, 0x27bf, 2), (0x2b1b, 0x2b1c, 2), (0x2b50, 0x2b50, 2), (0x2b55, 0x2b55, 2),
+        (0x2cef, 0x2cf1, 0), (0x2d7f, 0x2d7f, 0), (0x2de0, 0x2dff, 0), (0x2e80, 0x3029, 2),
+        (0x302a, 0x302d, 0), (0x302e, 0x303e, 2), (0x3041, 0x3096, 2), (0x3099, 0x309a, 0),
+        (0x309b, 0x3247, 2), (0x3250, 0x4dbf, 2), (0x4e00, 0xa4c6, 2), (0xa66f, 0xa672, 0),
+        (0xa674, 0xa67d, 0), (0xa69e, 0xa69f, 0), (0xa6f0, 0xa6f1, 0), (0xa802, 0xa802, 0),
+        (0xa806, 0xa806, 0), (0xa80b, 0xa80b, 0), (0xa825, 0xa826, 0), (0xa82c, 0xa82c, 0),
+        (0xa8c4, 0xa8c5, 0), (0xa8e0, 0xa8f1, 0), (0xa8ff, 0xa8ff, 0), (0xa926, 0xa92d, 0),
+        (0xa947, 0xa951, 0), (0xa960, 0xa97c, 2), (0xa980, 0xa982, 0), (0xa9b3, 0xa9b3, 0),
+        (0xa9b6, 0xa9b9, 0), (0xa9bc, 0xa9bd, 0), (0xa9e5, 0xa9e5, 0), (0xaa29, 0xaa2e, 0),
+        (0xaa31, 0xaa32, 0), (0xaa35, 0xaa36, 0), (0xaa43, 0xaa43, 0), (0xaa4c, 0xaa4c, 0),
+        (0xaa7c, 0xaa7c, 0), (0xaab0, 0xaab0, 0), (0xaab2, 0xaab4, 0), (0xaab7, 0xaab8, 0),
+        (0xaabe, 0xaabf, 0), (0xaac1, 0xaac1, 0), (0xaaec, 0xaaed, 0), (0xaaf6, 0xaaf6, 0),
+        (0xabe5, 0xabe5, 0), (0xabe8, 0xabe8, 0), (0xabed, 0xabed, 0), (0xac00, 0xd7a3, 2),
+        (0xd7b0, 0xd7ff, 0), (0xf900, 0xfaff, 2), (0xfb1e, 0xfb1e, 0), (0xfe00, 0xfe0f, 0),
+        (0xfe10, 0xfe19, 2), (0xfe20, 0xfe2f, 0), (0xfe30, 0xfe6b, 2), (0xfeff, 0xfeff, 0),
+        (0xff01, 0xff60, 2), (0xffe0, 0xffe6, 2), (0xfff9, 0xfffb, 0), (0x101fd, 0x101fd, 0),
+        (0x102e0, 0x102e0, 0), (0x10376, 0x1037a, 0), (0x10a01, 0x10a0f, 0), (0x10a38, 0x10a3f, 0),
+        (0x10ae5, 0x10ae6, 0), (0x10d24, 0x10d27, 0), (0x10eab, 0x10eac, 0), (0x10f46, 0x10f50, 0),
+        (0x10f82, 0x10f85, 0), (0x11001, 0x11001, 0), (0x11038, 0x11046, 0), (0x11070, 0x11070, 0),
+        (0x11073, 0x11074, 0), (0x1107f, 0x11081, 0), (0x110b3, 0x110b6, 0), (0x110b9, 0x110ba, 0),
+        (0x110bd, 0x110bd, 0), (0x110c2, 0x110cd, 0), (0x11100, 0x11102, 0), (0x11127, 0x1112b, 0),
+        (0x1112d, 0x11134, 0), (0x11173, 0x11173, 0), (0x11180, 0x11181, 0), (0x111b6, 0x111be, 0),
+        (0x111c9, 0x111cc, 0), (0x111cf, 0x111cf, 0), (0x1122f, 0x11231, 0), (0x11234, 0x11234, 0),
+        (0x11236, 0x11237, 0), (0x1123e, 0x1123e, 0), (0x112df, 0x112df, 0), (0x112e3, 0x112ea, 0),
+        (0x11300, 0x11301, 0), (0x1133b, 0x1133c, 0), (0x11340, 0x11340, 0), (0x11366, 0x11374, 0),
+        (0x11438, 0x1143f, 0), (0x11442, 0x11444, 0), (0x11446, 0x11446, 0), (0x1145e, 0x1145e, 0),
+        (0x114b3, 0x114b8, 0), (0x114ba, 0x114ba, 0), (0x114bf, 0x114c0, 0), (0x114c2, 0x114c3, 0),
+        (0x115b2, 0x115b5, 0), (0x115bc, 0x115bd, 0), (0x115bf, 0x115c0, 0), (0x115dc, 0x115dd, 0),
+        (0x11633, 0x1163a, 0), (0x1163d, 0x1163d, 0), (0x1163f, 0x11640, 0), (0x116ab, 0x116ab, 0),
+        (0x116ad, 0x116ad, 0), (0x116b0, 0x116b5, 0), (0x116b7, 0x116b7, 0), (0x1171d, 0x1171f, 0),
+        (0x11722, 0x11725, 0), (0x11727, 0x1172b, 0), (0x1182f, 0x11837, 0), (0x11839, 0x1183a, 0),
+        (0x1193b, 0x1193c, 0), (0x1193e, 0x1193e, 0), (0x11943, 0x11943, 0), (0x119d4, 0x119db, 0),
+        (0x119e0, 0x119e0, 0), (0x11a01, 0x11a0a, 0), (0x11a33, 0x11a38, 0), (0x11a3b, 0x11a3e, 0),
+        (0x11a47, 0x11a47, 0), (0x11a51, 0x11a56, 0), (0x11a59, 0x11a5b, 0), (0x11a8a, 0x11a96, 0),
+        (0x11a98, 0x11a99, 0), (0x11c30, 0x11c3d, 0), (0x11c3f, 0x11c3f, 0), (0x11c92, 0x11ca7, 0),
+        (0x11caa, 0x11cb0, 0), (0x11cb2, 0x11cb3, 0), (0x11cb5, 0x11cb6, 0), (0x11d31, 0x11d45, 0),
+        (0x11d47, 0x11d47, 0), (0x11d90, 0x11d91, 0), (0x11d95, 0x11d95, 0), (0x11d97, 0x11d97, 0),
+        (0x11ef3, 0x11ef4, 0), (0x13430, 0x13438, 0), (0x16af0, 0x16af4, 0), (0x16b30, 0x16b36, 0),
+        (0x16f4f, 0x16f4f, 0), (0x16f8f, 0x16f92, 0), (0x16fe0, 0x16fe3, 2), (0x16fe4, 0x16fe4, 0),
+        (0x16ff0, 0x1b2fb, 2), (0x1bc9d, 0x1bc9e, 0), (0x1bca0, 0x1cf46, 0), (0x1d167, 0x1d169, 0),
+        (0x1d173, 0x1d182, 0), (0x1d185, 0x1d18b, 0), (0x1d1aa, 0x1d1ad, 0), (0x1d242, 0x1d244, 0),
+        (0x1da00, 0x1da36, 0), (0x1da3b, 0x1da6c, 0), (0x1da75, 0x1da75, 0), (0x1da84, 0x1da84, 0),
+        (0x1da9b, 0x1daaf, 0), (0x1e000, 0x1e02a, 0), (0x1e130, 0x1e136, 0), (0x1e2ae, 0x1e2ae, 0),
+        (0x1e2ec, 0x1e2ef, 0), (0x1e8d0, 0x1e8d6, 0), (0x1e944, 0x1e94a, 0), (0x1f004, 0x1f004, 2),
+        (0x1f0cf, 0x1f0cf, 2), (0x1f18e, 0x1f18e, 2), (0x1f191, 0x1f19a, 2), (0x1f200, 0x1f320, 2),
+        (0x1f32d, 0x1f335, 2), (0x1f337, 0x1f37c, 2), (0x1f37e, 0x1f393, 2), (0x1f3a0, 0x1f3ca, 2),
+        (0x1f3cf, 0x1f3d3, 2), (0x1f3e0, 0x1f3f0, 2), (0x1f3f4, 0x1f3f4, 2), (0x1f3f8, 0x1f43e, 2),
+        (0x1f440, 0x1f440, 2), (0x1f442, 0x1f4fc, 2), (0x1f4ff, 0x1f53d, 2), (0x1f54b, 0x1f54e, 2),
+        (0x1f550, 0x1f567, 2), (0x1f57a, 0x1f57a, 2), (0x1f595, 0x1f596, 2), (0x1f5a4, 0x1f5a4, 2),
+        (0x1f5fb, 0x1f64f, 2), (0x1f680, 0x1f6c5, 2), (0x1f6cc, 0x1f6cc, 2), (0x1f6d0, 0x1f6d2, 2),
+        (0x1f6d5, 0x1f6df, 2), (0x1f6eb, 0x1f6ec, 2), (0x1f6f4, 0x1f6fc, 2), (0x1f7e0, 0x1f7f0, 2),
+        (0x1f90c, 0x1f93a, 2), (0x1f93c, 0x1f945, 2), (0x1f947, 0x1f9ff, 2), (0x1fa70, 0x1faf6, 2),
+        (0x20000, 0x3fffd, 2), (0xe0001, 0xe01ef, 0),
+        )
+width_table_starts = [first for first, last, width in width_table]
+
+
+class CharWidthTable(dict):
+    # Filled on first lookup of each code point, so each character is
+    # looked up in width_table only once per process
+    def __missing__(self, c):
+        o = ord(c)
+        i = bisect.bisect_right(width_table_starts, o) - 1
+        w = width_table[i][2] if i >= 0 and o <= width_table[i][1] else 1
+        self[c] = w
+        return w
+
+
+char_width = CharWidthTable()
 
 
-__all__ = ['strwidth', 'ljust', 'rjust']
-__all__ += ['ThreadedSpinner', 'prompt']
+def strwidth(s):
+    if s.isascii():
+        if '\033' in s:
+            s = decolor(s)
+        return len(s)
+
+    return strwidth_cached(s)
+
+
+@functools.lru_cache(maxsize=4096)
+def strwidth_cached(s):
+    s = decolor(s)
+    widths = list(map(char_width.__getitem__, s))
+    if 0 not in widths and max(s, default='') < '\U0001f3fb':
+        return sum(widths)
+
+    return sum(w for cluster, w in graphemes(s))
+
+
+def graphemes(s):
+    # Split plain text s into (cluster, width) pairs.
+    # Width of each grapheme cluster is the width of its base character,
+    # except that VS16 turns a narrow base into emoji presentation, and
+    # ZWJ / skin tone modifiers are joined into the preceding emoji
+    cluster = ''
+    width = 0
+    joining = False
+    for c in s:
+        w = char_width[c]
+        if w:
+            if joining:
+                joining = False
+            elif width == 2 and '\U0001f3fb' <= c <= '\U0001f3ff':
+                pass
+            else:
+                if cluster:
+                    yield (cluster, width)
+                cluster = ''
+                width = w
+        else:
+            joining = (c == '\u200d' and width == 2)
+            if c == '\ufe0f' and width == 1:
+                width = 2
+        cluster += c
+
+    if cluster:
+        yield (cluster, width)
+
+
+def cut(s, width, word=False):
+    # Split s into (head, tail), head is the longest prefix of s that fits
+    # in [width] columns, escape sequences before the cut are kept in head.
+    # If word is True, prefer to cut at the last space, which is dropped.
+    if s.isascii() and '\033' not in s:
+        if len(s) <= width:
+            return (s, '')
+        if word:
+            space = s.rfind(' ', 0, width + 1)
+            if space >= 0:
+                return (s[:space], s[space+1:])
+        return (s[:width], s[width:])
+
+    used = 0
+    pos = 0
+    space = None
+    for kind, token in ansi_tokenize(s):
+        if kind != 'text':
+            pos += len(token)
+            continue
+
+        for cluster, w in graphemes(token):
+            if used + w > width:
+                if word and cluster == ' ':
+                    return (s[:pos], s[pos+1:])
+                if word and space is not None:
+                    return (s[:space], s[space+1:])
+                return (s[:pos], s[pos:])
+
+            if cluster == ' ':
+                space = pos
+            used += w
+            pos += len(cluster)
+
+    return (s, '')
+
+
+def truncate(s, width, ellipsis='…'):
+    if strwidth(s) <= width:
+        return s
+
+    ellipsis_width = strwidth(ellipsis)
+    if ellipsis_width > width:
+        ellipsis = ''
+        ellipsis_width = 0
+
+    head, tail = cut(s, width - ellipsis_width)
+    if '\033' in tail:
+        # Keep the escape sequences that are cut off, e.g. color resets
+        tail = ''.join(token for kind, token in ansi_tokenize(tail) if kind != 'text')
+    else:
+        tail = ''
+    return head + ellipsis + tail
+
+
+def wordwrap(s, width):
+    lines = []
+    for line in s.split('\n'):
+        while strwidth(line) > width:
+            head, tail = cut(line, width, word=True)
+            if tail == line:
+                # Not even one character fits
+                head, tail = cut(line, 2)
+            lines.append(head)
+            line = tail
+            if not line:
+                break
+        else:
+            lines.append(line)
 
+    if '\033' not in s:
+        return lines
 
-def strwidth(s):
-    return sum((1 + (unicodedata.east_asian_width(c) in 'WF')) for c in decolor(s))
+    # Carry colors over line breaks
+    active = []
+    for idx, line in enumerate(lines):
+        prefix = ''.join(active)
+        for kind, token in ansi_tokenize(line):
+            if kind == 'sgr':
+                if token in ('\033[m', '\033[0m'):
+                    active = []
+                else:
+                    active.append(token)
+        lines[idx] = prefix + line + ('\033[m' if active else '')
+
+    return lines
 
 
 def lpad(text, padding):
@@ -29,66 +288,404 @@ def rpad(text, padding):
     return padding + text
 
 
-def just_elem(func):
-    def wrapper(elem, width, fillchar):
-        row, col, text = elem
-        padding = (width - strwidth(text)) * fillchar(row=row, col=col, text=text)
-        return func(text, padding)
-    return wrapper
+def just_row(pad, row, cells, fillchar):
+    # cells: (text, width of text, width of column)
+    if callable(fillchar):
+        return tuple(
+                pad(text, (w - tw) * fillchar(row=row, col=col, text=text))
+                for col, (text, tw, w) in enumerate(cells)
+                )
+
+    return tuple(pad(text, (w - tw) * fillchar) for text, tw, w in cells)
 
 
-def just_generator(just_func, data, width, fillchar):
+def just_fixed(pad, data, width, fillchar):
     for row, vector in enumerate(data):
         if isinstance(width, int):
-            width = (width,) * len(vector)
-        yield tuple(
-                just_func((row, col, text), w, fillchar)
-                for col, (text, w) in enumerate(zip_longest(vector, width[:len(vector)], fillvalues=('', 0)))
-                )
+            widths = itertools.repeat(width)
+        else:
+            widths = itertools.chain(width, itertools.repeat(0))
+        yield just_row(pad, row, ((text, strwidth(text), w) for text, w in zip(vector, widths)), fillchar)
+
+
+def widen(maxwidth, widths):
+    if len(widths) > len(maxwidth):
+        maxwidth.extend(itertools.repeat(0, len(widths) - len(maxwidth)))
 
+    for col, w in enumerate(widths):
+        if w > maxwidth[col]:
+            maxwidth[col] = w
 
-def just(just_func, data, width, fillchar):
-    if not callable(fillchar):
-        _fillchar = fillchar
-        fillchar = lambda row, col, text: _fillchar
 
+def row_cells(vector, widths, maxwidth):
+    lack = len(maxwidth) - len(vector)
+    if lack:
+        vector = itertools.chain(vector, itertools.repeat('', lack))
+        widths = itertools.chain(widths, itertools.repeat(0, lack))
+    return zip(vector, widths, maxwidth)
+
+
+def just_stream(pad, data, width, fillchar, sample):
+    # Column widths are determined by the first [sample] rows and
+    # widened whenever a wider cell shows up, rows are yielded right away
+    maxwidth = []
+    minwidth = 0
+    if isinstance(width, (tuple, list)):
+        maxwidth = list(width)
+    elif width:
+        minwidth = width
+
+    def measure(vector):
+        widths = [strwidth(text) for text in vector]
+        widen(maxwidth, [max(minwidth, w) for w in widths] if minwidth else widths)
+        return vector, widths
+
+    iterator = iter(data)
+    buffered = collections.deque(map(measure, itertools.islice(iterator, sample)))
+
+    def rows():
+        while buffered:
+            yield buffered.popleft()
+        yield from map(measure, iterator)
+
+    for row, (vector, widths) in enumerate(rows()):
+        yield just_row(pad, row, row_cells(vector, widths, maxwidth), fillchar)
+
+
+def just(pad, data, width, fillchar, sample=None):
     if isinstance(data, str):
-        return just_func((0, 0, data), width, fillchar)
+        if callable(fillchar):
+            fillchar = fillchar(row=0, col=0, text=data)
+        return pad(data, (width - strwidth(data)) * fillchar)
+
+    if sample is not None:
+        return just_stream(pad, data, width, fillchar, sample)
 
     if width:
         if isinstance(data, (tuple, list)):
-            t = type(data)
-        else:
-            t = lambda x: x
-        return t(just_generator(just_func, data, width, fillchar))
+            return type(data)(just_fixed(pad, data, width, fillchar))
+        return just_fixed(pad, data, width, fillchar)
 
+    # Measure each cell once, and reuse the widths for padding
+    rows = []
     maxwidth = []
     for vector in data:
-        maxwidth = [
-                max(w, strwidth(text))
-                for text, w in zip_longest(vector, maxwidth, fillvalues=('', 0))
-                ]
+        widths = [strwidth(text) for text in vector]
+        widen(maxwidth, widths)
+        rows.append((vector, widths))
 
     return [
-            tuple(
-                just_func((row, col, text), w, fillchar)
-                for col, (text, w) in enumerate(zip_longest(vector, maxwidth, fillvalues=('', 0)))
-                )
-            for row, vector in enumerate(data)
+            just_row(pad, row, row_cells(vector, widths, maxwidth), fillchar)
+            for row, (vector, widths) in enumerate(rows)
             ]
 
 
-def ljust(data, width=None, fillchar=' '):
-    return just(just_elem(lpad), data, width, fillchar)
+def ljust(data, width=None, fillchar=' ', sample=None):
+    return just(lpad, data, width, fillchar, sample)
+
+
+def rjust(data, width=None, fillchar=' ', sample=None):
+    return just(rpad, data, width, fillchar, sample)
+
+
+
+# Corners and junctions from top left to bottom right, then horizontal and vertical lines
+table_borders = {
+        'ascii': '+++++++++-|',
+        'single': '┌┬┐├┼┤└┴┘─│',
+        'double': '╔╦╗╠╬╣╚╩╝═║',
+        'rounded': '╭┬╮├┼┤╰┴╯─│',
+        }
+
+
+def table(data, header=None, align='<', maxwidth=None, wrap=False, border=None, ellipsis='…'):
+    '''
+    Render data (rows of cells) into a list of lines.
 
+    align: '<', '>' or '^' for all columns, or a string of them for each column
+    maxwidth: int for all columns, or a sequence of int / None for each column.
+              Cells wider than it are truncated with ellipsis, or wrapped if wrap is True
+    border: None, or one of 'ascii', 'single', 'double', 'rounded'
+    '''
+    if border is not None and border not in table_borders:
+        raise ValueError('Invalid border: ' + repr(border))
 
-def rjust(data, width=None, fillchar=' '):
-    return just(just_elem(rpad), data, width, fillchar)
+    rows = [[str(cell) for cell in row] for row in data]
+    if header is not None:
+        rows.insert(0, [str(cell) for cell in header])
 
+    ncols = max(map(len, rows), default=0)
 
+    if len(align) == 1:
+        align *= ncols
+    align = align.ljust(ncols, '<')
+    for a in align:
+        if a not in '<>^':
+            raise ValueError('Invalid align: ' + repr(a))
+
+    if maxwidth is None or isinstance(maxwidth, int):
+        maxwidth = [maxwidth] * ncols
+    else:
+        maxwidth = list(maxwidth) + [None] * (ncols - len(maxwidth))
+
+    # Layout: lines of each cell and their widths, measured once
+    colwidth = [0] * ncols
+    layout = []
+    for row in rows:
+        cells = []
+        for col in range(ncols):
+            text = row[col] if col < len(row) else ''
+            limit = maxwidth[col]
+
+            if limit is not None and wrap:
+                lines = wordwrap(text, limit)
+            elif '\n' in text:
+                lines = text.split('\n')
+            else:
+                lines = [text]
+
+            measured = []
+            for line in lines:
+                w = strwidth(line)
+                if limit is not None and w > limit and not wrap:
+                    line = truncate(line, limit, ellipsis)
+                    w = strwidth(line)
+                measured.append((line, w))
+                if w > colwidth[col]:
+                    colwidth[col] = w
+
+            cells.append(measured)
+        layout.append(cells)
+
+    if border:
+        tl, tc, tr, ml, mc, mr, bl, bc, br, h, v = table_borders[border]
+        left, sep, right = v + ' ', ' ' + v + ' ', ' ' + v
+
+        def rule(l, c, r):
+            return l + c.join(h * (w + 2) for w in colwidth) + r
+    else:
+        left, sep, right = '', ' ', ''
+
+    def render(cells):
+        ret = []
+        for (text, w), width, a in zip(cells, colwidth, align):
+            space = width - w
+            if not space:
+                ret.append(text)
+            elif a == '<':
+                ret.append(text + ' ' * space)
+            elif a == '>':
+                ret.append(' ' * space + text)
+            else:
+                ret.append(' ' * (space // 2) + text + ' ' * (space - space // 2))
+        return left + sep.join(ret) + right
+
+    ret = []
+    if border:
+        ret.append(rule(tl, tc, tr))
+
+    for idx, cells in enumerate(layout):
+        height = max(map(len, cells), default=1)
+        if height == 1:
+            ret.append(render([lines[0] for lines in cells]))
+        else:
+            for i in range(height):
+                ret.append(render([lines[i] if i < len(lines) else ('', 0) for lines in cells]))
+
+        if border and idx == 0 and header is not None and len(layout) > 1:
+            ret.append(rule(ml, mc, mr))
+
+    if border:
+        ret.append(rule(bl, bc, br))
+
+    return ret
+
+
+class SpinnerRenderer:
+    '''
+    Draws all running spinners and progress bars in one thread, one line for each.
+
+    A frame is written only when a spinner ticks or its text changes, with
+    one print_function() call, the one of the earliest spinner on screen.
+    '''
+    def __init__(self):
+        self.lock = threading.Condition()
+        self.thread = None
+        self.spinners = []
+        self.dirty = False
+        self.lines = 0
+
+    def attach(self, spinner):
+        with self.lock:
+            spinner.next_tick = time.monotonic() + spinner.delay
+            self.spinners.append(spinner)
+            self.wake()
+
+            if not self.thread:
+                self.thread = threading.Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+
+    def wake(self):
+        with self.lock:
+            self.dirty = True
+            self.lock.notify()
+
+    def sleep(self, timeout):
+        with self.lock:
+            if not self.dirty:
+                self.lock.wait(timeout)
+
+    def render(self, now):
+        # Return (frame, timeout, finished spinners), frame is None if nothing changed
+        changed = self.dirty
+        self.dirty = False
+
+        timeout = None
+        finished = []
+        for spinner in self.spinners:
+            if spinner.done.is_set():
+                continue
+
+            if spinner.next_tick <= now:
+                spinner.tick(now)
+                changed = True
+                spinner.next_tick += spinner.delay
+                if spinner.next_tick <= now:
+                    spinner.next_tick = now + spinner.delay
+
+            if spinner.finished:
+                finished.append(spinner)
+            elif timeout is None or spinner.next_tick - now < timeout:
+                timeout = spinner.next_tick - now
+
+        if not changed:
+            return (None, timeout, finished)
+
+        frame = '\n'.join('\r' + spinner.line() for spinner in self.spinners)
+        if self.lines > 1:
+            frame = '\033[{}A'.format(self.lines - 1) + frame
+        self.lines = len(self.spinners)
+
+        return (frame, timeout, finished)
+
+    def run(self):
+        try:
+            self.loop()
+        finally:
+            # Release spinners if the loop is broken by an exception, so end() does not hang
+            with self.lock:
+                spinners = []
+                if self.thread is threading.current_thread():
+                    spinners, self.spinners = self.spinners, []
+                    self.thread = None
+                    self.lines = 0
+
+            for spinner in spinners:
+                spinner.done.set()
+
+    def loop(self):
+        while True:
+            with self.lock:
+                frame, timeout, finished = self.render(time.monotonic())
+                print_function = self.spinners[0].print_function
+                spinners = self.spinners
+                if all(spinner.done.is_set() or spinner in finished for spinner in spinners):
+                    self.spinners = []
+                    self.lines = 0
+                else:
+                    spinners = None
+
+            try:
+                if frame is not None:
+                    print_function(frame, end='')
+
+                if spinners is not None:
+                    print_function()
+
+            finally:
+                for spinner in finished:
+                    spinner.done.set()
+
+            if spinners is not None:
+                with self.lock:
+                    if not self.spinners:
+                        self.thread = None
+                        return
+                continue
+
+            self.sleep(timeout)
+
+
+spinner_renderer = SpinnerRenderer()
+
+
+class RenderItem:
+    '''
+    Base class of the items drawn by the spinner renderer, one line for each.
+
+    Subclasses implement tick(now), line() and finished for the renderer,
+    and leave(), which is called once by end() with the renderer lock held.
+    '''
+    def __init__(self, text='', delay=0.1):
+        self.delay = delay
+        self.is_end = False
+        self.started = False
+        self.done = threading.Event()
+        self.next_tick = 0
+        self._text = str(text)
+
+        self.renderer = spinner_renderer
+        self.print_function = print
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end()
+
+    def text(self, *args):
+        if not args:
+            return self._text
 
-class ThreadedSpinner:
+        self._text = ' '.join(str(a) for a in args)
+        if self.started:
+            self.refresh()
+
+    def refresh(self):
+        self.renderer.wake()
+
+    def start(self):
+        if self.started:
+            return
+
+        self.started = True
+        self.renderer.attach(self)
+
+    def leave(self):
+        pass
+
+    def end(self, wait=True):
+        with self.renderer.lock:
+            if not self.is_end:
+                self.leave()
+                self.is_end = True
+                if self.started:
+                    self.refresh()
+
+        if wait:
+            self.join()
+
+    def join(self):
+        if self.started:
+            self.done.wait()
+
+
+class ThreadedSpinner(RenderItem):
     def __init__(self, *icon, delay=0.1):
+        super().__init__(delay=delay)
+
         if not icon:
             self.icon_entry = '⠉⠛⠿⣿⠿⠛⠉⠙'
             self.icon_loop = '⠹⢸⣰⣤⣆⡇⠏⠛'
@@ -117,10 +714,6 @@ class ThreadedSpinner:
             else:
                 raise ValueError('Invalid value of icon[{}]: {}'.format(name, icon))
 
-        self.delay = delay
-        self.is_end = False
-        self.thread = None
-        self._text = ''
         self.icon_iter = (
                 itertools.chain(
                     self.icon_entry,
@@ -129,18 +722,7 @@ class ThreadedSpinner:
                 iter(self.icon_leave)
                 )
         self.icon_head = [None, None]
-
-        self.print_function = print
-
-    def __enter__(self):
-        if self.thread:
-            return self
-
-        self.start()
-        return self
-
-    def __exit__(self, exc_type, exc_value, traceback):
-        self.end()
+        self.icon_leave_queue = None
 
     @property
     def icon(self):
@@ -149,48 +731,128 @@ class ThreadedSpinner:
             self.icon_head[idx] = next(self.icon_iter[idx])
         return self.icon_head[idx]
 
-    def text(self, *args):
-        if not args:
-            return self._text
-
-        self._text = ' '.join(str(a) for a in args)
-        if self.thread:
-            self.refresh()
+    def tick(self, now):
+        if not self.is_end:
+            self.icon_head[0] = next(self.icon_iter[0])
+        elif self.icon_leave_queue:
+            self.icon_head[1] = self.icon_leave_queue.popleft()
 
-    def refresh(self):
-        self.print_function('\r' + self.icon + '\033[K ' + self._text, end='')
+    @property
+    def finished(self):
+        return self.is_end and not self.icon_leave_queue
+
+    def line(self):
+        return self.icon + '\033[K ' + self._text
+
+    def leave(self):
+        # Leave icons are drawn right away, instead of on next tick
+        self.icon_leave_queue = collections.deque(self.icon_iter[1])
+        self.icon_head[1] = self.icon_leave_queue.popleft() if self.icon_leave_queue else self.icon
+        self.next_tick = time.monotonic() + self.delay
+
+
+def format_duration(secs):
+    secs = int(secs)
+    if secs >= 3600:
+        return '{}:{:02}:{:02}'.format(secs // 3600, secs // 60 % 60, secs % 60)
+    return '{}:{:02}'.format(secs // 60, secs % 60)
+
+
+class ProgressBar(RenderItem):
+    '''
+    A progress line with counts, rate and ETA, drawn by the spinner renderer.
+
+    update() is cheap enough to be called from many worker threads for every
+    item: it only appends to a deque, and counts are collected on repaint,
+    which happens at most once per [delay] seconds.
+    '''
+    def __init__(self, text='', total=None, width=20, delay=0.1):
+        super().__init__(text, delay=delay)
+        self.total = total
+        self.width = width
+        self.count = 0
+        self.rate = None
+        self.pending = collections.deque()
+        self.last = (0, 0)
+
+    def update(self, n=1):
+        self.pending.append(n)
+
+    def tick(self, now):
+        # Only called from the render thread, the only consumer of pending
+        count = self.count
+        while self.pending:
+            count += self.pending.popleft()
+        self.count = count
+
+        last_time, last_count = self.last
+        if now > last_time:
+            rate = (count - last_count) / (now - last_time)
+            self.rate = rate if self.rate is None else (self.rate * 0.7 + rate * 0.3)
+            self.last = (now, count)
 
-    def animate(self):
-        while not self.is_end:
-            self.refresh()
-            time.sleep(self.delay)
-            self.icon_head[0] = next(self.icon_iter[0])
+    @property
+    def finished(self):
+        return self.is_end
+
+    def line(self):
+        ret = '\033[K'
+        if self._text:
+            ret += self._text + ' '
+
+        if self.total:
+            ratio = min(max(self.count / self.total, 0), 1)
+            filled = int(ratio * self.width)
+            ret += '█' * filled + '░' * (self.width - filled)
+            ret += ' {}/{} {:>4.0%}'.format(self.count, self.total, ratio)
+        else:
+            ret += str(self.count)
 
-        try:
-            while True:
-                self.refresh()
-                self.icon_head[1] = next(self.icon_iter[1])
-                time.sleep(self.delay)
-        except StopIteration:
-            pass
+        if self.rate is not None:
+            ret += ' {:.1f}/s'.format(self.rate)
+            if self.total and not self.is_end and self.rate > 0 and self.count < self.total:
+                ret += ' ETA ' + format_duration((self.total - self.count) / self.rate)
 
-        self.print_function()
+        return ret
 
     def start(self):
-        if self.thread:
-            return
+        if not self.started:
+            self.last = (time.monotonic(), self.count)
+        super().start()
 
-        self.thread = threading.Thread(target=self.animate)
-        self.thread.daemon = True
-        self.thread.start()
+    def leave(self):
+        # Collect the final counts on next frame
+        self.next_tick = time.monotonic()
 
-    def end(self, wait=True):
-        self.is_end = True
-        if wait:
-            self.join()
 
-    def join(self):
-        self.thread.join()
+class Progress:
+    '''
+    Manages progress bars of many concurrent tasks, ends all of them on exit.
+    '''
+    def __init__(self, width=20, delay=0.1):
+        self.width = width
+        self.delay = delay
+        self.bars = []
+        self.print_function = print
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end()
+
+    def add(self, text='', total=None):
+        bar = ProgressBar(text, total=total, width=self.width, delay=self.delay)
+        bar.print_function = self.print_function
+        self.bars.append(bar)
+        bar.start()
+        return bar
+
+    def end(self):
+        for bar in self.bars:
+            bar.end(wait=False)
+        for bar in self.bars:
+            bar.join()
 
 
 def alt_if_none(A, B):
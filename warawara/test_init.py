@@ -0,0 +1,40 @@
+import importlib
+import subprocess
+import sys
+
+from .test_utils import *
+
+import warawara
+
+
+class TestLazyLoading(TestCase):
+    def test_exports_match_all(self):
+        for mod_name, attrs in warawara._exports.items():
+            module = importlib.import_module('warawara.' + mod_name)
+            self.eq(attrs, module.__all__)
+
+        for ext_name, mod_name in warawara._modules.items():
+            self.is_true(ext_name == 'bin' or mod_name in warawara._exports)
+
+    def test_resolve(self):
+        self.is_true(warawara.paints is importlib.import_module('warawara.lib_paints'))
+        self.is_true(warawara.red is warawara.paints.red)
+        self.is_true(warawara.bin.sponge is importlib.import_module('warawara.bin_sponge'))
+        self.is_true('red' in dir(warawara))
+
+        with self.assertRaises(AttributeError):
+            warawara.no_such_attr
+
+        with self.assertRaises(AttributeError):
+            warawara.bin.no_such_cmd
+
+    def test_import_is_lazy(self):
+        code = '\n'.join([
+            'import sys',
+            'import warawara',
+            'print(sorted(m for m in sys.modules if m.startswith("warawara")))',
+            'warawara.paint',
+            'print("warawara.lib_paints" in sys.modules, "warawara.lib_subproc" in sys.modules)',
+            ])
+        p = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, universal_newlines=True, check=True)
+        self.eq(p.stdout.splitlines(), ["['warawara']", 'True False'])
@@ -1,3 +1,5 @@
+import unittest.mock
+
 from .test_utils import *
 
 from warawara import *
@@ -67,6 +69,12 @@ class TestDyeTrait(TestCase):
         self.eq(self.orange.bg('text'), '\033[48;5;208mtext\033[m')
         self.eq(self.coffee.bg('text'), '\033[48;2;192;255;238mtext\033[m')
 
+    def test_multiple_args(self):
+        self.eq(self.orange('text', 1, None), '\033[38;5;208mtext 1 None\033[m')
+        self.eq(self.orange.bg('text', 1), '\033[48;5;208mtext 1\033[m')
+        self.eq(nocolor('text', 1), 'text 1')
+        self.eq(nocolor(1), '1')
+
     def test_str(self):
         self.eq(str(self.orange), '\033[38;5;208m')
         self.eq(str(self.coffee), '\033[38;2;192;255;238m')
@@ -88,6 +96,55 @@ class TestDyeTrait(TestCase):
         self.eq(self.orange | self.coffee, self.orange)
 
 
+class TestDyeInterning(TestCase):
+    def test_interned(self):
+        self.is_true(dye(208) is dye256(208))
+        self.is_true(dye(208) is dye((208,)))
+        self.is_true(dye() is nocolor)
+        self.is_true(dye(0xC0, 0xFF, 0xEE) is dyergb('#C0FFEE'))
+        self.is_true(dyergb() is dyergb())
+
+    def test_immutable(self):
+        with self.assertRaises(AttributeError):
+            orange.code = 1
+
+        with self.assertRaises(AttributeError):
+            dyergb(1, 2, 3).r = 0
+
+        with self.assertRaises(AttributeError):
+            del orange.seq
+
+        with self.assertRaises(AttributeError):
+            orange.wah = 1
+
+    def test_hash(self):
+        self.eq(len({dye(208), dye256(208), dye(1), dye(1, 2, 3), dyergb([1, 2, 3])}), 3)
+        self.eq(len({nocolor, dye256()}), 1)
+
+    def test_bool_is_not_int(self):
+        with self.assertRaises(TypeError):
+            dye256(True)
+
+        with self.assertRaises(TypeError):
+            dyergb(True, 0, 0)
+
+        with self.assertRaises(TypeError):
+            dye(1, 2, 256)
+
+    def test_copy(self):
+        import copy
+        import pickle
+        for d in (nocolor, orange, dyergb(), dyergb(1, 2, 3)):
+            self.is_true(copy.copy(d) is d)
+            self.is_true(copy.deepcopy(d) is d)
+            self.is_true(pickle.loads(pickle.dumps(d)) is d)
+
+    def test_prefix(self):
+        self.eq(orange.fg_prefix, '\033[38;5;208m')
+        self.eq(orange.bg_prefix, '\033[48;5;208m')
+        self.eq(nocolor.fg_prefix, '')
+
+
 class TestDye256(TestCase):
     def test_dye256(self):
         orange = dye(208)
@@ -106,6 +163,119 @@ class TestDyeRGB(TestCase):
         self.eq(int(orange), 0xA05A00)
 
 
+class TestQuantize(TestCase):
+    def test_quantize(self):
+        import random
+
+        def rgb_of(code):
+            if code >= 232:
+                return ((8 + 10 * (code - 232)),) * 3
+            c = code - 16
+            levels = (0, 95, 135, 175, 215, 255)
+            return (levels[c // 36], levels[(c % 36) // 6], levels[c % 6])
+
+        def linear_scan(r, g, b):
+            return min(range(16, 256), key=lambda code: sum((x - y) ** 2 for x, y in zip((r, g, b), rgb_of(code))))
+
+        def dist(code, rgb):
+            return sum((x - y) ** 2 for x, y in zip(rgb, rgb_of(code)))
+
+        rng = random.Random(2024)
+        for i in range(2000):
+            rgb = tuple(rng.randrange(256) for i in range(3))
+            res = dyergb(rgb).to_dye256()
+            self.is_true(isinstance(res, dye256))
+            self.eq(dist(res.code, rgb), dist(linear_scan(*rgb), rgb))
+
+        for code in range(16, 256):
+            self.eq(quantize(dyergb(rgb_of(code))).code, code)
+
+    def test_quantize_packed(self):
+        self.eq(quantize(0xFF8700), dye(208))
+        self.eq(quantize(0x000000), dye(16))
+        self.eq(quantize(0x121212), dye(233))
+        self.is_true(dyergb().to_dye256() is nocolor)
+
+
+class TestColorDepth(TestCase):
+    def setUp(self):
+        self.addCleanup(set_color_depth, 1 << 24)
+
+    def test_detect(self):
+        class FakeStream:
+            def __init__(self, tty):
+                self.tty = tty
+            def isatty(self):
+                return self.tty
+
+        tty = FakeStream(True)
+        self.eq(detect_color_depth(tty, {'TERM': 'xterm-256color', 'COLORTERM': 'truecolor'}), 1 << 24)
+        self.eq(detect_color_depth(tty, {'TERM': 'xterm-256color'}), 256)
+        self.eq(detect_color_depth(tty, {'TERM': 'xterm'}), 16)
+        self.eq(detect_color_depth(tty, {'TERM': 'dumb', 'COLORTERM': 'truecolor'}), 0)
+        self.eq(detect_color_depth(tty, {'TERM': 'xterm-256color', 'NO_COLOR': '1'}), 0)
+        self.eq(detect_color_depth(FakeStream(False), {'TERM': 'xterm-256color'}), 0)
+        self.eq(detect_color_depth(object(), {'TERM': 'xterm-256color'}), 0)
+
+    def test_invalid_value(self):
+        with self.assertRaises(ValueError):
+            set_color_depth(8)
+
+    def test_no_color(self):
+        p = paint(fg=red, bg=yellow)
+        coffee = dye('#C0FFEE')
+        self.eq(set_color_depth(0), 0)
+
+        self.eq(red('text'), 'text')
+        self.eq(coffee.bg('text'), 'text')
+        self.eq(red(b'text'), b'text')
+        self.eq(p('text'), 'text')
+        self.eq(p.join(['a', 'b'], ' '), 'a b')
+        self.eq(str(red), '')
+        self.eq(str(nocolor), '')
+        self.eq(str(p), '')
+        self.eq(p, paint(fg=red, bg=yellow))
+        self.ne(p, paint(fg=red))
+
+    def test_equal_instances(self):
+        a = paint(fg=red)
+        b = paint(fg=red)
+        black = dyergb(0, 0, 0)
+        self.eq(a, b)
+        self.eq(black, dyergb())
+
+        set_color_depth(0)
+        self.eq(a('x'), 'x')
+        self.eq(b('x'), 'x')
+        self.eq(black('x'), 'x')
+
+    def test_16(self):
+        p = paint(fg=red, bg=12)
+        set_color_depth(16)
+
+        self.eq(red('text'), '\033[31mtext\033[m')
+        self.eq(dye(9)('text'), '\033[91mtext\033[m')
+        self.eq(red.bg('text'), '\033[41mtext\033[m')
+        self.eq(p('text'), '\033[31;104mtext\033[m')
+        self.eq(dye(196)('text'), '\033[91mtext\033[m')
+        self.eq(dye(255, 0, 0)('text'), '\033[91mtext\033[m')
+        self.eq(dye(240)('text'), '\033[90mtext\033[m')
+        self.eq(dye(1, 2, 3).bg('text'), '\033[40mtext\033[m')
+
+    def test_256(self):
+        set_color_depth(256)
+        self.eq(orange('text'), '\033[38;5;208mtext\033[m')
+        self.eq(dye(0xFF, 0x87, 0x00)('text'), '\033[38;5;208mtext\033[m')
+        self.eq(paint(bg=dye(0xFF, 0x87, 0x00))('text'), '\033[48;5;208mtext\033[m')
+
+    def test_restore(self):
+        coffee = dye('#C0FFEE')
+        set_color_depth(0)
+        set_color_depth(1 << 24)
+        self.eq(orange('text'), '\033[38;5;208mtext\033[m')
+        self.eq(coffee('text'), '\033[38;2;192;255;238mtext\033[m')
+
+
 class TestBuiltInDyes(TestCase):
     def test_nocolor(self):
         self.eq(nocolor(), '')
@@ -167,12 +337,271 @@ class TestPaint(TestCase):
         self.eq(~rybg, paint(fg=blue, bg=red))
         self.eq((~rybg)('text'), '\033[38;5;4;48;5;1mtext\033[m')
 
+    def test_map(self):
+        p = paint(fg=red, bg=yellow)
+        lines = ['line1', 'line2', 3]
+        self.eq(list(p.map(lines)), [p(str(line)) for line in lines])
+        self.eq(list(paint().map(lines)), ['line1', 'line2', '3'])
+
+    def test_join(self):
+        p = paint(fg=red, bg=yellow)
+        lines = ['line1', '', 3]
+        self.eq(p.join(lines), ''.join(p.map(lines)))
+        self.eq(p.join(lines, '\n'), '\n'.join(p.map(lines)))
+        self.eq(p.join([], '\n'), '')
+        self.eq(paint().join(lines, ', '), 'line1, , 3')
+
+
+class TestStyled(TestCase):
+    def test_render(self):
+        self.eq(str(styled()), '')
+        self.eq(str(styled('text')), 'text')
+        self.eq(str(styled('text', red)), red('text'))
+
+        s = styled('hello ', red) + styled('world', red) + ' ' + styled('哇嗚', blue / yellow) + styled('x', ~yellow)
+        self.eq(len(s.spans), 4)
+        self.eq(s.text, 'hello world 哇嗚x')
+        self.eq(str(s), '\033[38;5;1mhello world\033[m \033[38;5;4;48;5;3m哇嗚\033[39mx\033[m')
+        self.eq(decolor(str(s)), s.text)
+
+        s = styled('a', red / yellow) + styled('b', yellow / yellow) + styled('c', paint(fg=yellow))
+        self.eq(str(s), '\033[38;5;1;48;5;3ma\033[38;5;3mb\033[49mc\033[m')
+
+    def test_from_spans(self):
+        s = styled.from_spans([('a', red), ('b', None), ('c', red / yellow)])
+        self.eq(s, styled('a', red) + 'b' + styled('c', red / yellow))
+        self.eq(str(s), red('a') + 'b' + (red / yellow)('c'))
+
+        s.append('d', red)
+        self.eq(s.spans[-1], ('d', paint(fg=red)))
+
+    def test_concat(self):
+        s = 'a' + styled('b', red) + 'c'
+        self.is_true(isinstance(s, styled))
+        self.eq(str(s), 'a' + red('b') + 'c')
+        self.eq(s, styled('a') + styled('b', paint(fg=red)) + styled('c'))
+        self.ne(s, styled('abc'))
+
+        s += styled('d', red)
+        self.eq(str(s), 'a' + red('b') + 'c' + red('d'))
+
+        with self.assertRaises(TypeError):
+            s + 1
+
+    def test_width(self):
+        s = styled('哇嗚', red) + 'wah'
+        self.eq(len(s), 7)
+        self.is_true(bool(s))
+        self.is_false(bool(styled()))
+
+    def test_slice(self):
+        s = styled('hello ', red) + styled('哇嗚', blue) + 'wah'
+        self.eq(s[:], s)
+        self.eq(s[2:4], styled('ll', red))
+        self.eq(s[4:9], styled('o ', red) + styled('哇', blue))
+        self.eq(s[7:9], styled())
+        self.eq(s[8:-1], styled('嗚', blue) + 'wa')
+        self.eq(len(s[-3:]), 3)
+
+        # Grapheme clusters are not split
+        s = styled('a\U0001f468\u200d\U0001f469\u200d\U0001f467b', red)
+        self.eq(len(s), 4)
+        self.eq(s[3:4].text, 'b')
+        self.eq(s[1:3].text, '\U0001f468\u200d\U0001f469\u200d\U0001f467')
+        self.eq(s[2:4].text, 'b')
+
+        s = styled('a\u2764\ufe0fb\U0001f44d\U0001f3fdc')
+        self.eq(len(s), 7)
+        self.eq(s[1:3].text, '\u2764\ufe0f')
+        self.eq(s[1:2].text, '')
+        self.eq(s[4:6].text, '\U0001f44d\U0001f3fd')
+        self.eq(s[3:7].text, 'b\U0001f44d\U0001f3fdc')
+
+        with self.assertRaises(TypeError):
+            s[0]
+
+        with self.assertRaises(ValueError):
+            s[::2]
+
 
 class TestDecolor(TestCase):
     def test_decolor(self):
         self.eq(decolor(orange('test')), 'test')
         self.eq(decolor('\033[1;31mred\033[m'), 'red')
 
+    def test_decolor_escape_sequences(self):
+        self.eq(decolor('\033[2K\033[1Atext\033[K'), 'text')
+        self.eq(decolor('\033]8;;http://example.com\033\\link\033]8;;\007'), 'link')
+        self.eq(decolor('\033(Btext\033='), 'text')
+        self.eq(decolor('text\033['), 'text\033[')
+
+    def test_decolor_bytes(self):
+        self.eq(decolor(b'\033[1;31mred\033[m'), b'red')
+        self.eq(decolor(bytearray(b'\033[1;31mred\033[m')), b'red')
+        self.eq(decolor(memoryview(b'\033[1;31mred\033[m')), b'red')
+
+
+class TestAnsiTokenize(TestCase):
+    def test_tokenize(self):
+        text = 'a' + orange('b') + '\033[K\033]8;;url\033\\c\033]8;;\007\033(Bd\033'
+        self.eq(list(ansi_tokenize(text)), [
+            ('text', 'a'),
+            ('sgr', '\033[38;5;208m'),
+            ('text', 'b'),
+            ('sgr', '\033[m'),
+            ('csi', '\033[K'),
+            ('osc', '\033]8;;url\033\\'),
+            ('text', 'c'),
+            ('osc', '\033]8;;\007'),
+            ('esc', '\033(B'),
+            ('text', 'd\033'),
+            ])
+
+        self.eq(list(ansi_tokenize('')), [])
+        self.eq(list(ansi_tokenize(b'\033[1;31mred')), [('sgr', b'\033[1;31m'), ('text', b'red')])
+
+
+class TestSgrMinimize(TestCase):
+    def test_minimize(self):
+        self.eq(sgr_minimize(''), '')
+        self.eq(sgr_minimize('text'), 'text')
+        self.eq(sgr_minimize(red('a') + red('b')), red('ab'))
+        self.eq(sgr_minimize(red('a') + ' ' + red('b')), red('a') + ' ' + red('b'))
+        self.eq(sgr_minimize((black / red)('a') + (black / green)('b') + '\n'),
+                '\033[38;5;0;48;5;1ma\033[48;5;2mb\033[m\n')
+        self.eq(sgr_minimize('\033[1m\033[31mx\033[22my\033[0m'), '\033[1;31mx\033[22my\033[m')
+        self.eq(sgr_minimize('\033[1;31mx\033[m\033[31my\033[m'), '\033[1;31mx\033[22my\033[m')
+        self.eq(sgr_minimize('\033[1;4;7mx\033[m\033[31my'), '\033[1;4;7mx\033[0;31my')
+        self.eq(sgr_minimize('\033[31m\033[32m\033[m'), '')
+        self.eq(sgr_minimize('\033[31m'), '\033[31m')
+        self.eq(sgr_minimize('\033[38;2;1;2;3mx\033[39m'), '\033[38;2;1;2;3mx\033[m')
+
+    def test_bold_and_faint(self):
+        self.eq(sgr_minimize('\033[1m\033[2mx'), '\033[1;2mx')
+        self.eq(sgr_minimize('\033[1;2;31mx\033[22my'), '\033[1;2;31mx\033[22my')
+        self.eq(sgr_minimize('\033[1;2mx\033[0;2my'), '\033[1;2mx\033[0;2my')
+        self.eq(sgr_minimize('\033[2mx\033[0;1my'), '\033[2mx\033[0;1my')
+
+    def test_colon_params(self):
+        self.eq(sgr_minimize('\033[38:5:1ma\033[39mb'), '\033[38:5:1ma\033[mb')
+        self.eq(sgr_minimize('\033[1;38:5:1ma\033[39mb'), '\033[1;38:5:1ma\033[39mb')
+        self.eq(sgr_minimize('\033[1;48:2::1:2:3ma\033[41mb\033[49mc'), '\033[1;48:2::1:2:3ma\033[41mb\033[49mc')
+        self.eq(sgr_minimize('\033[31;4:3ma\033[4:0mb'), '\033[4:3;31ma\033[24mb')
+        self.eq(sgr_minimize('\033[31ma\033[38:5:1mb'), '\033[31ma\033[38:5:1mb')
+
+    def test_unknown_params(self):
+        self.eq(sgr_minimize('\033[53mx\033[1my\033[m'), '\033[53mx\033[1my\033[m')
+        self.eq(sgr_minimize('\033[53;31mx\033[0;31my'), '\033[31;53mx\033[0;31my')
+
+    def test_other_escape_sequences(self):
+        # \033[K erases with current background color, so colors are written out before it
+        s = (~red)('a') + '\033[K' + (~red)('b')
+        self.eq(sgr_minimize(s), s)
+        self.eq(sgr_minimize('\033[41m\033[m\033[41m\033[K'), '\033[41m\033[K')
+
+    def test_chunks(self):
+        text = (red('a') + red('b') + (black / red)('c') + (black / green)('d') + '\033[K\n') * 3
+        ans = sgr_minimize(text)
+        self.eq(decolor(ans), decolor(text))
+        self.is_true(len(ans) < len(text))
+
+        for size in range(1, len(text) + 1):
+            m = sgr_minimizer()
+            res = ''.join(m.feed(text[i:i+size]) for i in range(0, len(text), size))
+            self.eq(res + m.flush(), ans)
+
+
+class TestDecolorizer(TestCase):
+    def test_chunks(self):
+        text = orange('test') + ' ' + paint(fg=red, bg=yellow)('wah') + '\033[1;31m\033'
+        text += '\033]8;;url\033\\link\033]8;;\007\033[2K\033(B\033]'
+        ans = decolor(text)
+
+        for size in range(1, len(text) + 1):
+            d = decolorizer()
+            res = ''.join(d.feed(text[i:i+size]) for i in range(0, len(text), size))
+            self.eq(res + d.flush(), ans)
+
+    def test_chunks_bytes(self):
+        text = (orange('test') + ' ' + paint(fg=red, bg=yellow)('wah') + '\033[').encode()
+        ans = decolor(text)
+
+        for size in range(1, len(text) + 1):
+            d = decolorizer()
+            res = b''.join(d.feed(memoryview(text)[i:i+size]) for i in range(0, len(text), size))
+            self.eq(res + d.flush(), ans)
+
+    def test_not_escape_sequence(self):
+        d = decolorizer()
+        self.eq(d.flush(), '')
+        self.eq(d.feed('a\033'), 'a')
+        self.eq(d.feed('\x01b'), '\033\x01b')
+        self.eq(d.feed('\033[1'), '')
+        self.eq(d.feed('Ktext'), 'text')
+        self.eq(d.flush(), '')
+
+    def test_unterminated_control_string(self):
+        d = decolorizer()
+        text = 'log \033]0;title'
+        res = d.feed(text)
+        self.eq(res, 'log ')
+
+        for i in range(1000):
+            text += 'x' * 1024
+            res += d.feed('x' * 1024)
+            self.le(len(d.pending), 4096)
+
+        self.eq(res + d.flush(), decolor(text))
+
+        m = sgr_minimizer()
+        res = m.feed(text[:10]) + ''.join(m.feed(text[i:i+1024]) for i in range(10, len(text), 1024))
+        self.le(len(m.pending), 4096)
+        self.eq(res + m.flush(), text)
+
+    def test_decolor_file(self):
+        import io
+        text = orange('test') + '\n' + red('wah') * 100
+
+        src = io.StringIO(text)
+        dst = io.StringIO()
+        decolor_file(src, dst, chunk_size=7)
+        self.eq(dst.getvalue(), decolor(text))
+
+        src = io.BytesIO(text.encode() + b'\033[')
+        dst = io.BytesIO()
+        decolor_file(src, dst, chunk_size=5)
+        self.eq(dst.getvalue(), decolor(text.encode()) + b'\033[')
+
+
+class TestBytes(TestCase):
+    def test_dye(self):
+        self.eq(orange(b'text'), b'\033[38;5;208mtext\033[m')
+        self.eq(orange.bg(bytearray(b'text')), b'\033[48;5;208mtext\033[m')
+        self.eq(orange.apply('38', memoryview(b'text')), b'\033[38;5;208mtext\033[m')
+        self.eq(nocolor(memoryview(b'text')), b'text')
+
+    def test_paint(self):
+        p = paint(fg=red, bg=yellow)
+        self.eq(p(b'text'), p('text').encode())
+        self.eq(p(memoryview(b'text')), p('text').encode())
+        self.eq(paint()(bytearray(b'text')), b'text')
+        self.is_true(isinstance(paint()(bytearray(b'text')), bytes))
+
+    def test_write(self):
+        import io
+
+        p = paint(fg=red, bg=yellow)
+        buf = bytearray(b'>')
+        self.eq(p.write(buf, b'text'), len(p('text')))
+        self.eq(orange.write(buf, memoryview(b'text')), len(orange('text')))
+        self.eq(paint().write(buf, bytearray(b'text')), 4)
+        self.eq(buf, ('>' + p('text') + orange('text') + 'text').encode())
+
+        f = io.BytesIO()
+        p.write(f, b'text')
+        nocolor.write(f, b'text')
+        self.eq(f.getvalue(), (p('text') + 'text').encode())
+
 
 class TestGradient(TestCase):
     def test_invalid_values(self):
@@ -295,3 +724,60 @@ class TestGradient(TestCase):
         B = dye('#FF1100')
         res = gradient(A, B, N=3)
         self.eq(res, (A, dye('#FF0000'), B))
+
+
+class TestGradientPacked(TestCase):
+    def test_hsv(self):
+        A = dye(242, 5, 148)
+        B = dye(146, 219, 189)
+        for N in (2, 3, 7, 15):
+            res = gradient_packed(A, B, N)
+            self.eq(list(res), [int(c) for c in gradient(A, B, N)])
+
+    def test_rgb(self):
+        A = dye(0, 0, 0)
+        B = dye(255, 128, 10)
+        self.eq(list(gradient_packed(A, B, 3, space='rgb')), [0x000000, 0x7F4005, 0xFF800A])
+
+    def test_perceptual(self):
+        black = dye(0, 0, 0)
+        white = dye(255, 255, 255)
+        self.eq(list(gradient_packed(black, white, 5, space='oklab')),
+                [0x000000, 0x222222, 0x636363, 0xAEAEAE, 0xFFFFFF])
+        self.eq(list(gradient_packed(black, white, 5, space='lab')),
+                [0x000000, 0x3B3B3B, 0x777777, 0xB9B9B9, 0xFFFFFF])
+
+        A = dye('#FF1100')
+        B = dye('#0011FF')
+        for space in ('oklab', 'lab'):
+            res = gradient(A, B, 5, space=space)
+            self.eq(res[0], A)
+            self.eq(res[-1], B)
+            self.eq([int(c) for c in res], list(gradient_packed(A, B, 5, space=space)))
+
+    def test_invalid_values(self):
+        with self.assertRaises(ValueError):
+            gradient_packed(dye(0, 0, 0), dye(1, 1, 1), 5, space='wah')
+
+        with self.assertRaises(ValueError):
+            gradient(dye(0, 0, 0), dye(1, 1, 1), 5, space='wah')
+
+        with self.assertRaises(ValueError):
+            gradient_packed(dye(0, 0, 0), dye(1, 1, 1), 1)
+
+    def test_large_n(self):
+        import warawara.lib_paints
+        A = dye('#FF1100')
+        B = dye('#0011FF')
+        res = gradient(A, B, 5000)
+        self.eq(len(res), 5000)
+        self.eq(res[0], A)
+        self.eq(res[-1], B)
+
+        if warawara.lib_paints.load_numpy() is None:
+            self.skipTest('NumPy is not available')
+
+        for space in ('hsv', 'rgb', 'oklab', 'lab'):
+            with unittest.mock.patch('warawara.lib_paints.gradient_numpy_threshold', 10 ** 9):
+                pure = gradient_packed(A, B, 5000, space=space)
+            self.eq(gradient_packed(A, B, 5000, space=space), pure)
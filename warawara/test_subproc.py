@@ -1,4 +1,6 @@
 import queue
+import threading
+import time
 
 from .test_utils import *
 
@@ -144,6 +146,88 @@ class TestStream(TestCase):
         with self.assertRaises(BrokenPipeError):
             s.writeline('line2', suppress=False)
 
+    def test_stream_bounded_drop(self):
+        lines = []
+        s = stream()
+        s.welcome((True, bounded(3, 'drop'), lines.append))
+        s.writelines(['line1', 'line2', 'line3', 'line4', 'line5'])
+
+        self.eq(s.dropped, 2)
+        self.eq(s.lines, ['line1', 'line2', 'line3'])
+        self.eq(lines, ['line1', 'line2', 'line3', 'line4', 'line5'])
+        self.eq(s.readline(), 'line1')
+
+        s.writeline('line6')
+        self.eq([s.readline() for i in range(3)], ['line2', 'line3', 'line6'])
+
+    def test_stream_bounded_ring(self):
+        s = stream()
+        s.welcome((True, bounded(3, 'ring')))
+        s.writelines(['line1', 'line2', 'line3', 'line4', 'line5'])
+
+        self.eq(s.dropped, 2)
+        self.eq(list(s.lines), ['line3', 'line4', 'line5'])
+        self.eq([s.readline() for i in range(3)], ['line3', 'line4', 'line5'])
+
+    def test_stream_bounded_block(self):
+        s = stream()
+        s.welcome(bounded(2))
+        s.writelines(['line1', 'line2'])
+        self.is_true(s.full)
+
+        t = threading.Thread(target=s.writelines, args=(['line3', 'line4'],))
+        t.start()
+        t.join(0.1)
+        self.is_true(t.is_alive())
+
+        self.eq(s.readline(), 'line1')
+        self.eq(s.readline(), 'line2')
+        t.join()
+
+        self.eq(s.dropped, 0)
+        self.eq([s.readline(), s.readline()], ['line3', 'line4'])
+
+    def test_stream_tail(self):
+        s = stream()
+        s.welcome(tail(3))
+        s.writelines(['line{}'.format(i) for i in range(10)])
+        self.eq(list(s.lines), ['line7', 'line8', 'line9'])
+        self.eq(s.queue.qsize(), 3)
+
+        s = stream()
+        s.welcome(tail(nbytes=12))
+        s.writelines(['line{}'.format(i) for i in range(10)])
+        self.eq(list(s.lines), ['line8', 'line9'])
+        self.eq(list(s.queue.queue), ['line8', 'line9'])
+        self.eq(s.queue_bytes, 12)
+
+        s.writeline('哇' * 10)
+        self.eq(list(s.lines), ['哇' * 10])
+        self.eq(list(s.queue.queue), ['哇' * 10])
+
+        self.eq(s.readline(), '哇' * 10)
+        self.eq(s.queue_bytes, 0)
+
+        lines = []
+        s = stream()
+        s.welcome((tail(2, nbytes=100), lines.append))
+        s.writelines(['line1', 'line2', 'line3'])
+        self.eq(list(s.lines), ['line2', 'line3'])
+        self.eq(lines, ['line1', 'line2', 'line3'])
+
+        with self.assertRaises(ValueError):
+            tail()
+
+        with self.assertRaises(ValueError):
+            tail(0)
+
+    def test_stream_bounded_invalid(self):
+        with self.assertRaises(ValueError):
+            bounded(0)
+
+        with self.assertRaises(ValueError):
+            bounded(10, 'wah')
+
 
 class TestSubproc(TestCase):
     def test_default_properties(self):
@@ -435,6 +519,270 @@ class TestSubproc(TestCase):
             self.eq(lines, ans)
 
 
+class TestSubprocMultiplexer(TestCase):
+    def test_decode(self):
+        p = run(['printf', 'a\\nb'])
+        self.eq(p.stdout.lines, ['a', 'b'])
+
+        p = run(['printf', 'a\\r\\nb\\r\\n\\n'])
+        self.eq(p.stdout.lines, ['a', 'b', ''])
+
+        p = run(['printf', '\\377\\345\\223\\207'])
+        self.eq(p.stdout.lines, ['\\xff哇'])
+
+    def test_large_io(self):
+        p = run('seq 100000'.split())
+        self.eq(len(p.stdout.lines), 100000)
+        self.eq(p.stdout.lines[-1], '100000')
+
+        lines = [str(i) * 10 for i in range(20000)]
+        p = run(['cat'], stdin=lines)
+        self.eq(p.stdout.lines, lines)
+
+    def test_run_in_callback(self):
+        lines = []
+        p = run(['printf', 'a\\nb\\n'], stdout=lambda line: lines.append(run(['echo', 'inner-' + line]).stdout.lines),
+                wait=False)
+        p.wait(timeout=3)
+        self.eq(lines, [['inner-a'], ['inner-b']])
+
+    def test_blocked_callback(self):
+        # A blocked subscriber only holds back its own command
+        Q = queue.Queue(maxsize=1)
+        p1 = run('seq 100'.split(), stdout=Q, wait=False)
+        p2 = run('seq 100'.split())
+        self.eq(len(p2.stdout.lines), 100)
+
+        self.eq([Q.get() for i in range(100)], [str(i) for i in range(1, 101)])
+        p1.wait()
+
+    def test_one_io_thread(self):
+        threads = threading.active_count()
+
+        ps = [run(['sh', '-c', 'sleep 0.2; echo {}; echo {} >&2'.format(i, -i)], stdin=['wah'], wait=False)
+              for i in range(20)]
+        self.le(threading.active_count(), threads + 1)
+
+        for i, p in enumerate(ps):
+            p.wait()
+            self.eq(p.stdout.lines, [str(i)])
+            self.eq(p.stderr.lines, [str(-i)])
+
+    def test_shared_delivery_threads(self):
+        threads = threading.active_count()
+
+        counts = []
+        lines = [[] for i in range(50)]
+        ps = [run(['sh', '-c', 'sleep 0.2; echo {}'.format(i)],
+                  stdout=(lines[i].append, lambda line: counts.append(threading.active_count())), wait=False)
+              for i in range(50)]
+
+        for p in ps:
+            p.wait()
+        self.eq(lines, [[str(i)] for i in range(50)])
+        self.le(max(counts), threads + 3)
+
+    def test_tail(self):
+        p = run('seq 100000'.split(), stdout=tail(1000))
+        self.eq(len(p.stdout.lines), 1000)
+        self.eq(p.stdout.lines[0], '99001')
+        self.eq(p.stdout.lines[-1], '100000')
+        self.le(p.stdout.queue.qsize(), 1001)
+
+        import sys
+        p = run([sys.executable, '-c', 'for i in range(2000): print(str(i % 10) * 10000)'],
+                stdout=tail(nbytes=100000))
+        self.eq(len(p.stdout.lines), 9)
+        self.le(sum(len(line) + 1 for line in p.stdout.queue.queue if line is not None), 100000)
+
+    def test_mode_bytes(self):
+        data = bytes(range(256)) * 1000
+        p = run(['cat'], stdin=[data[:1000], data[1000:]], mode='bytes')
+        self.is_true(all(isinstance(chunk, bytes) for chunk in p.stdout.lines))
+        self.eq(b''.join(p.stdout.lines), data)
+
+        p = run(['printf', 'a\\r\\nb'], stdin=b'', mode='bytes')
+        self.eq(b''.join(p.stdout.lines), b'a\r\nb')
+
+        with self.assertRaises(ValueError):
+            command('true', mode='wah')
+
+    def test_mode_chunks(self):
+        data = bytearray()
+        p = run(['seq', 100000], stdout=data.extend, stderr=False, mode='chunks')
+        self.eq(p.stdout.lines, [])
+        self.eq(data, ''.join('{}\n'.format(i) for i in range(1, 100001)).encode())
+
+        for stdout in (True, queue.Queue(), bounded(10), tail(10), (data.extend, True)):
+            with self.assertRaises(ValueError):
+                command(['seq', 10], stdout=stdout, stderr=None, mode='chunks')
+
+        with self.assertRaises(ValueError):
+            command(['seq', 10], stdout=data.extend, mode='chunks')
+
+    def test_backpressure(self):
+        p = run('seq 100000'.split(), stdout=bounded(10), wait=False)
+        time.sleep(0.1)
+        self.le(p.stdout.queue.qsize(), 10)
+        self.eq(p.proc.poll(), None)
+
+        lines = list(p.stdout)
+        p.wait()
+        self.eq(p.returncode, 0)
+        self.eq(len(lines), 100000)
+        self.eq(lines[-1], '100000')
+
+    def test_backpressure_kill(self):
+        p = run('seq 100000'.split(), stdout=bounded(10), wait=False)
+        time.sleep(0.1)
+        p.kill()
+        p.wait()
+        self.is_true(p.stdout.closed)
+
+        # The delivery of subscribers is blocked by the bounded stream
+        lines = []
+        p = run('seq 100000'.split(), stdout=(bounded(10), lines.append), wait=False)
+        time.sleep(0.1)
+        p.kill()
+        p.wait()
+        self.is_true(p.stdout.closed)
+
+
+class TestSubprocAsync(TestCase):
+    def arun(self, coro):
+        import asyncio
+        return asyncio.run(coro)
+
+    def test_stdout(self):
+        p = self.arun(arun('seq 5'.split()))
+        self.eq(p.returncode, 0)
+        self.eq(p.stdout.lines, '1 2 3 4 5'.split())
+
+        p = self.arun(arun('false'))
+        self.eq(p.returncode, 1)
+
+    def test_stdin_and_subscribers(self):
+        Q = queue.Queue()
+        lines = []
+        p = self.arun(arun('nl -w 1 -s :'.split(), stdin=['hello', 'world'], stdout=(Q, lines.append)))
+        self.eq(p.stdin.lines, ['hello', 'world'])
+        self.eq(p.stdout.lines, [])
+        self.eq(lines, ['1:hello', '2:world'])
+        self.eq(queue_to_list(Q), ['1:hello', '2:world'])
+
+    def test_decode(self):
+        for cmd in (['printf', 'a\\rb\\r\\nc'], ['printf', '\\377\\345\\223\\207\\n']):
+            self.eq(self.arun(arun(cmd)).stdout.lines, run(cmd).stdout.lines)
+        self.eq(self.arun(arun(['printf', 'a\\rb\\n'])).stdout.lines, ['a', 'b'])
+
+        p = self.arun(arun(['head', '-c', 1 << 21, '/dev/zero']))
+        self.eq(p.returncode, 0)
+        self.eq(p.stdout.lines, ['\0' * (1 << 21)])
+
+    def test_stderr(self):
+        p = self.arun(arun(['sh', '-c', 'echo wah >&2; echo wah wah'], stdout=False))
+        self.eq(p.stdout.lines, [])
+        self.eq(p.stderr.lines, ['wah'])
+
+    def test_callable(self):
+        def prog(proc, *args):
+            for line in proc[0]:
+                proc[1].writeline(line + args[0])
+            return 2024
+
+        p = self.arun(arun(prog, '!', stdin=['hello', 'world']))
+        self.eq(p.stdout.lines, ['hello!', 'world!'])
+        self.eq(p.returncode, 2024)
+
+        def prog(proc):
+            n + 1
+
+        with self.assertRaises(NameError):
+            self.arun(arun(prog))
+
+    def test_async_iteration(self):
+        async def main():
+            p = await arun(['sh', '-c', 'echo wah; read line; echo $line'], stdin=True, wait=False)
+
+            lines = []
+            async for line in p.stdout:
+                lines.append(line)
+                p.stdin.writeline(line + ' wah')
+                p.stdin.close()
+
+            await p
+            return lines
+
+        self.eq(self.arun(main()), ['wah', 'wah wah'])
+
+    def test_bounded(self):
+        async def main():
+            p = await arun('seq 1000'.split(), stdout=bounded(10), wait=False)
+
+            lines = []
+            async for line in p.stdout:
+                self.le(p.stdout.queue.qsize(), 10)
+                lines.append(line)
+
+            await p
+            return lines
+
+        self.eq(self.arun(main()), [str(i) for i in range(1, 1001)])
+
+    def test_mode_bytes(self):
+        p = self.arun(arun(['cat'], stdin=[b'\xff\0', b'wah\n'], mode='bytes'))
+        self.eq(b''.join(p.stdout.lines), b'\xff\0wah\n')
+
+    def test_mode_chunks(self):
+        chunks = []
+        p = self.arun(arun(['printf', 'wah'], stdout=chunks.append, stderr=False, mode='chunks'))
+        self.eq(p.stdout.lines, [])
+        self.eq(chunks, [b'wah'])
+
+    def test_backpressure_kill(self):
+        import asyncio
+
+        async def main():
+            p = await arun('seq 100000'.split(), stdout=bounded(10), wait=False)
+            await asyncio.sleep(0.1)
+            p.kill()
+            await asyncio.wait_for(p.async_wait(), 5)
+            return p
+
+        p = self.arun(main())
+        self.ne(p.returncode, 0)
+        self.is_true(p.stdout.closed)
+
+    def test_many_commands(self):
+        import asyncio
+
+        async def main():
+            ps = await asyncio.gather(*[arun(['echo', i]) for i in range(50)])
+            return [p.stdout.lines for p in ps]
+
+        threads = threading.active_count()
+        self.eq(self.arun(main()), [[str(i)] for i in range(50)])
+        self.le(threading.active_count(), threads)
+
+    def test_timeout(self):
+        async def main():
+            p = command(['sleep', 3])
+            with self.assertRaises(TimeoutExpired):
+                await p.arun(timeout=0.1)
+
+            with self.assertRaises(AlreadyRunningError):
+                await p.arun()
+
+            with self.assertRaises(RuntimeError):
+                p.wait()
+
+            p.kill()
+            await p
+            return p.returncode
+
+        self.ne(self.arun(main()), 0)
+
+
 class TestSubprocRunMocker(TestCase):
     def test_mock_basic(self):
         mock_run = RunMocker()
@@ -2,6 +2,7 @@ import queue
 
 import functools
 import threading
+import time
 import unittest.mock
 
 from collections import namedtuple
@@ -16,6 +17,47 @@ class TestTypesettingUtils(TestCase):
         self.eq(strwidth('test'), 4)
         self.eq(strwidth(orange('test')), 4)
         self.eq(strwidth('哇嗚'), 4)
+        self.eq(strwidth('\033[K\033]8;;url\033\\link\033]8;;\033\\'), 4)
+        self.eq(strwidth(''), 0)
+        self.eq(strwidth(orange('哇嗚') + 'wah'), 7)
+        self.eq(strwidth('ＡＢ，ab'), 8)
+
+    def test_strwidth_grapheme_cluster(self):
+        self.eq(strwidth('e\u0301'), 1)            # combining acute accent
+        self.eq(strwidth('caf\u00e9 cafe\u0301'), 9)
+        self.eq(strwidth('a\u200bb'), 2)           # zero width space
+        self.eq(strwidth('\u1100\u1161\u11a8'), 2) # conjoining hangul jamo
+        self.eq(strwidth('한글'), 4)
+        self.eq(strwidth('👍'), 2)
+        self.eq(strwidth('👍🏽'), 2)                 # skin tone modifier
+        self.eq(strwidth('🏽'), 2)
+        self.eq(strwidth('❤'), 1)
+        self.eq(strwidth('❤\ufe0f'), 2)            # emoji presentation
+        self.eq(strwidth('👨\u200d👩\u200d👧'), 2)   # ZWJ sequence
+        self.eq(strwidth('👩\u200d❤\ufe0f\u200d👨'), 2)
+        self.eq(strwidth('🇹🇼'), 2)
+        self.eq(strwidth('क\u200dष'), 2)           # ZWJ between narrow characters
+        self.eq(strwidth(orange('👍🏽') + '哇'), 4)
+        self.eq(strwidth('\033]8;;哇\033\\'), 0)
+
+    def test_width_table(self):
+        from warawara.lib_tui import width_table
+        for (a, b, w), (c, d, x) in zip(width_table, width_table[1:]):
+            self.le(a, b)
+            self.le(b + 1, c)
+            self.is_true(w in (0, 2))
+
+    def test_strwidth_cache(self):
+        from warawara.lib_tui import strwidth_cached
+        strwidth_cached.cache_clear()
+
+        self.eq(strwidth('test'), 4)
+        self.eq(strwidth_cached.cache_info().currsize, 0)
+
+        for i in range(3):
+            self.eq(strwidth('哇嗚'), 4)
+        info = strwidth_cached.cache_info()
+        self.eq((info.hits, info.misses), (2, 1))
 
     def test_ljust_str(self):
         self.eq(ljust('test', 10), 'test      ')
@@ -122,6 +164,62 @@ class TestTypesettingUtils(TestCase):
             ('word3     ', 'word4 long words    '),
             ])
 
+        self.eq(ljust(vector for vector in data), [
+            ('column1', 'col2            '),
+            ('word1  ', 'word2           '),
+            ('word3  ', 'word4 long words'),
+            ])
+
+    def test_just_stream(self):
+        data = [
+                ('column1', 'col2'),
+                ('word1', 'word2'),
+                ('word3', 'word4 long words'),
+                ('wah',),
+                ]
+
+        def rows():
+            for vector in data:
+                consumed.append(vector)
+                yield vector
+
+        consumed = []
+        ret = ljust(rows(), sample=2)
+        self.is_false(isinstance(ret, (tuple, list)))
+        self.eq(consumed, [])
+
+        self.eq(next(ret), ('column1', 'col2 '))
+        self.eq(consumed, data[:2])
+        self.eq(next(ret), ('word1  ', 'word2'))
+        self.eq(consumed, data[:2])
+
+        # Wider cell shows up, following rows are re-flowed
+        self.eq(list(ret), [
+            ('word3  ', 'word4 long words'),
+            ('wah    ', '                '),
+            ])
+
+        self.eq(list(rjust(iter(data), sample=0)), [
+            ('column1', 'col2'),
+            ('  word1', 'word2'),
+            ('  word3', 'word4 long words'),
+            ('    wah', '                '),
+            ])
+
+        self.eq(list(ljust(data, width=(8, 6), sample=1, fillchar='.')), [
+            ('column1.', 'col2..'),
+            ('word1...', 'word2.'),
+            ('word3...', 'word4 long words'),
+            ('wah.....', '................'),
+            ])
+
+        self.eq(list(rjust(data, width=6, sample=10)), [
+            ('column1', '            col2'),
+            ('  word1', '           word2'),
+            ('  word3', 'word4 long words'),
+            ('    wah', '                '),
+            ])
+
     def test_just_rect_lack_columns(self):
         self.eq(
                 ljust([
@@ -155,6 +253,79 @@ class TestTypesettingUtils(TestCase):
                     ])
 
 
+class TestTable(TestCase):
+    def test_table(self):
+        data = [
+                ('1', orange('哇嗚') + ' wah'),
+                ('22', 'é'),
+                ('333',),
+                ]
+
+        self.eq(table(data), [
+            '1   ' + orange('哇嗚') + ' wah',
+            '22  é       ',
+            '333         ',
+            ])
+
+        self.eq(table(data, header=('id', 'name'), align='>^', border='single'), [
+            '┌─────┬──────────┐',
+            '│  id │   name   │',
+            '├─────┼──────────┤',
+            '│   1 │ ' + orange('哇嗚') + ' wah │',
+            '│  22 │    é     │',
+            '│ 333 │          │',
+            '└─────┴──────────┘',
+            ])
+
+        self.eq(table([('a', 'b')], border='ascii'), [
+            '+---+---+',
+            '| a | b |',
+            '+---+---+',
+            ])
+
+        self.eq(table([]), [])
+        self.eq(table([(1, 2.5)]), ['1 2.5'])
+
+        with self.assertRaises(ValueError):
+            table(data, border='wah')
+
+        with self.assertRaises(ValueError):
+            table(data, align='<|')
+
+    def test_table_multiline(self):
+        self.eq(table([('a\nb', 'c'), ('d', 'e')], align='>'), [
+            'a c',
+            'b  ',
+            'd e',
+            ])
+
+    def test_table_truncate(self):
+        data = [('0123456789', '哇嗚哇嗚哇嗚', orange('orange text'))]
+
+        self.eq(table(data, maxwidth=5), [
+            '0123… 哇嗚… ' + orange('oran…'),
+            ])
+
+        self.eq(table(data, maxwidth=(None, 6, None), ellipsis='...'), [
+            '0123456789 哇... ' + orange('orange text'),
+            ])
+
+        self.eq(table(data, maxwidth=(None, 1, 0)), [
+            '0123456789 … \033[38;5;208m\033[m',
+            ])
+
+    def test_table_wrap(self):
+        data = [('word1 word2 word3', orange('哇嗚哇嗚哇') + '嗚')]
+
+        self.eq(table(data, maxwidth=(11, 4), wrap=True), [
+            'word1 word2 ' + orange('哇嗚'),
+            'word3       ' + orange('哇嗚'),
+            '            ' + orange('哇') + '嗚',
+            ])
+
+        self.eq(table([('哇',)], maxwidth=1, wrap=True), ['哇'])
+
+
 def queue_to_list(Q):
     ret = []
     while not Q.empty():
@@ -186,10 +357,12 @@ class TestThreadedSpinner(TestCase):
 
         if not self.events_upon_sleep.empty():
             callback = self.events_upon_sleep.get()
+            self.events_upon_sleep.task_done()
+
+            # The render thread is woken up by callback
             if callable(callback):
                 callback()
-
-            self.events_upon_sleep.task_done()
+                return
 
         self.sys_time += secs
 
@@ -239,7 +412,8 @@ class TestThreadedSpinner(TestCase):
                 spinner.start()
 
     def test_run(self):
-        self.patch('time.sleep', self.mock_sleep)
+        self.patch('warawara.lib_tui.SpinnerRenderer.sleep', self.mock_sleep)
+        self.patch('time.monotonic', lambda: self.sys_time)
         Event = self.__class__.Event
 
         delay = 1
@@ -268,6 +442,7 @@ class TestThreadedSpinner(TestCase):
                 Event( 9, 'print', ('L', 'meow')),
                 Event( 9, 'sleep', delay, functools.partial(spinner.text, 'woof')),
                 Event( 9, 'print', ('L', 'woof')),
+                Event( 9, 'sleep', delay),
                 Event(10, 'print', ('O', 'woof')),
                 Event(10, 'sleep', delay),
                 Event(11, 'print', ('O', 'woof')),
@@ -282,12 +457,12 @@ class TestThreadedSpinner(TestCase):
                 Event(15, 'sleep', delay),
                 Event(16, 'print', ('P', 'woof')),
                 Event(16, 'sleep', delay, functools.partial(spinner.end, wait=False)),
-                Event(17, 'print', ('O', 'woof')),
+                Event(16, 'print', ('O', 'woof')),
+                Event(16, 'sleep', delay),
+                Event(17, 'print', ('U', 'woof')),
                 Event(17, 'sleep', delay),
-                Event(18, 'print', ('U', 'woof')),
-                Event(18, 'sleep', delay),
-                Event(19, 'print', ('T', 'woof')),
-                Event(19, 'print'),
+                Event(18, 'print', ('T', 'woof')),
+                Event(18, 'print'),
                 ]
 
         for event in filter(lambda e: e.tag == 'sleep', event_list):
@@ -302,6 +477,122 @@ class TestThreadedSpinner(TestCase):
             expected = (e.timestamp, e.tag, e.args)
             self.eq(expected, behavior)
 
+    def test_end_without_waiting_delay(self):
+        spinner = ThreadedSpinner(delay=60)
+        spinner.print_function = lambda *args, **kwargs: None
+
+        t = time.monotonic()
+        with spinner:
+            spinner.text('wah')
+        self.le(time.monotonic() - t, 5)
+        self.is_true(spinner.done.is_set())
+
+    def test_print_function_raises(self):
+        from warawara.lib_tui import SpinnerRenderer
+        renderer = SpinnerRenderer()
+
+        def print_function(*args, **kwargs):
+            raise OSError('wah')
+
+        spinner = ThreadedSpinner(delay=60)
+        spinner.renderer = renderer
+        spinner.print_function = print_function
+
+        with unittest.mock.patch('threading.excepthook', lambda args: None):
+            with spinner:
+                spinner.text('wah')
+
+        self.is_true(spinner.done.is_set())
+        self.eq(renderer.thread, None)
+        self.eq(renderer.spinners, [])
+
+    def test_multiple_spinners(self):
+        from warawara.lib_tui import SpinnerRenderer
+        renderer = SpinnerRenderer()
+
+        a = ThreadedSpinner('A', 'a', 'Z', delay=1)
+        b = ThreadedSpinner('B', 'b', 'Y', delay=2)
+        for spinner in (a, b):
+            spinner.text(spinner.icon_entry)
+            spinner.started = True
+            spinner.renderer = renderer
+        a.next_tick, b.next_tick = 1, 2
+        renderer.spinners = [a, b]
+        renderer.dirty = True
+
+        self.eq(renderer.render(0), ('\rA\033[K A\n\rB\033[K B', 1, []))
+        self.eq(renderer.render(0), (None, 1, []))
+        self.eq(renderer.render(0.5), (None, 0.5, []))
+        self.eq(renderer.render(1), ('\033[1A\ra\033[K A\n\rB\033[K B', 1, []))
+
+        a.text('wah')
+        self.eq(renderer.render(1.5), ('\033[1A\ra\033[K wah\n\rB\033[K B', 0.5, []))
+
+        with unittest.mock.patch('time.monotonic', lambda: 1.5):
+            a.end(wait=False)
+        self.eq(renderer.render(1.5), ('\033[1A\rZ\033[K wah\n\rB\033[K B', 0.5, [a]))
+        a.done.set()
+
+        self.eq(renderer.render(2), ('\033[1A\rZ\033[K wah\n\rb\033[K B', 2, []))
+
+
+class TestProgress(TestCase):
+    def test_format_duration(self):
+        from warawara.lib_tui import format_duration
+        self.eq(format_duration(0), '0:00')
+        self.eq(format_duration(61.5), '1:01')
+        self.eq(format_duration(3600 * 25 + 62), '25:01:02')
+
+    def test_progress_bar(self):
+        bar = ProgressBar('wah', total=100, width=10)
+        self.eq(bar.line(), '\033[Kwah ░░░░░░░░░░ 0/100   0%')
+
+        bar.last = (0, 0)
+        for i in range(20):
+            bar.update()
+        self.eq(bar.count, 0)
+
+        bar.tick(1)
+        self.eq(bar.count, 20)
+        self.eq(bar.line(), '\033[Kwah ██░░░░░░░░ 20/100  20% 20.0/s ETA 0:04')
+
+        bar.update(30)
+        bar.tick(2)
+        self.eq(bar.line(), '\033[Kwah █████░░░░░ 50/100  50% 23.0/s ETA 0:02')
+
+        bar.is_end = True
+        self.is_true(bar.finished)
+        self.eq(bar.line(), '\033[Kwah █████░░░░░ 50/100  50% 23.0/s')
+
+        bar = ProgressBar()
+        bar.update(3)
+        bar.tick(0)
+        self.eq(bar.line(), '\033[K3')
+
+    def test_progress_threads(self):
+        output = []
+        with Progress() as progress:
+            progress.print_function = lambda *args, **kwargs: output.append(args)
+            bars = [progress.add('task{}'.format(i), total=1000) for i in range(4)]
+
+            def worker(bar):
+                for i in range(1000):
+                    bar.update()
+
+            threads = [threading.Thread(target=worker, args=(bar,)) for bar in bars]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        for bar in bars:
+            self.eq(bar.count, 1000)
+            self.is_true(bar.done.is_set())
+
+        self.eq(output[-1], tuple())
+        self.eq(len(output[-2][0].split('\n')), 4)
+        self.is_true(all('1000/1000' in line for line in output[-2][0].split('\n')))
+
 
 class TestPromotAskUser(TestCase):
     def setUp(self):